@@ -1,96 +1,17 @@
+import os
 import argparse
 import pathlib
 import csv
-import json
-
-import ecole as ec
 
 import numpy as np
 import random
-import ConfigSpace.hyperparameters as CSH
 
-# Import ConfigSpace and different types of parameters
-from smac.configspace import ConfigurationSpace
 #from smac.facade.smac_bo_facade import SMAC4BO
 from smac.facade.smac_hpo_facade import SMAC4HPO
 # Import SMAC-utilities
 from smac.scenario.scenario import Scenario
 from smac.initial_design.random_configuration_design import RandomConfigurations
 
-# generate parameters in correct format for SMAC from file
-def getParamsFromFile(paramfile):
-    file = open(paramfile,'r').readlines()
-
-    params = []
-
-    i = 0
-    while i < len(file):
-        line = file[i].split()
-
-        paramname = line[0]
-        paramtype = line[1]
-        default = line[3][1:-1]
-
-        if paramtype == 'categorical':
-            params += [CSH.CategoricalHyperparameter(paramname, choices=line[2][1:-1].split(','), default_value=default)]
-        else:
-            bounds = line[2][1:-1].split(',')
-
-            if paramtype == 'real':
-
-                if float(default) > 1e+100:
-                    i += 1
-                    continue
-                
-                # SMAC cannot handle too large limits, so change them to something smaller
-                if float(bounds[0]) <= -1e+100:
-                    bounds[0] = -1e+100
-                if float(bounds[1]) >= 1e+100:
-                    bounds[1] = 1e+100
-
-                params += [CSH.UniformFloatHyperparameter(paramname, float(bounds[0]), float(bounds[1]), default_value=float(default))]
-            
-            elif paramtype == 'integer':
-                params += [CSH.UniformIntegerHyperparameter(paramname, lower=int(bounds[0]), upper=int(bounds[1]), default_value=int(default))]
-        i += 1
-
-    return params
-
-# runs ecole and returns primal-dual integral as a reward
-def runEcole(settings, instance):
-
-    print("New Ecole run with instance ", instance)
-
-    # read the instance's initial primal and dual bounds from JSON file
-    with open(pathlib.PosixPath(instance).with_name(pathlib.PosixPath(instance).stem).with_suffix('.json')) as f:
-        instance_info = json.load(f)
-
-    # set up the reward function parameters for that instance
-    initial_primal_bound = instance_info["primal_bound"]
-    initial_dual_bound = instance_info["dual_bound"]
-    objective_offset = 0
-
-    TimeLimitPrimalDualIntegral().set_parameters(
-            initial_primal_bound=initial_primal_bound,
-            initial_dual_bound=initial_dual_bound,
-            objective_offset=objective_offset)
-
-    # start a new episode
-    env.reset(instance)
-
-    # get the next action from the given settings
-    action = {k: settings[k] for k in settings}
-
-    for k in action.keys():
-        if action[k] == 'TRUE':
-            action[k] = True
-        elif action[k] == 'FALSE':
-            action[k] = False
-
-    # apply the action and collect the reward
-    _, _, reward, _, _ = env.step(action)
-
-    return reward
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -123,6 +44,28 @@ if __name__ == '__main__':
         default=10,
         type=int,
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        help='Number of SCIP runs evaluated in parallel, in separate worker processes.',
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        '-p', '--pin',
+        help='Pin each parallel worker to its own set of CPUs.',
+        action='store_true',
+    )
+    parser.add_argument(
+        '-c', '--cache',
+        help='Directory of the persistent run cache, reused across tuning campaigns.',
+        default='run_cache',
+        type=str,
+    )
+    parser.add_argument(
+        '-r', '--racing',
+        help='Interrupt the runs whose integral exceeds the one of the incumbent on their instance.',
+        action='store_true',
+    )
     args = parser.parse_args()
 
     # collect the instance files
@@ -161,28 +104,23 @@ if __name__ == '__main__':
     # get primal-dual integral function that is also used in evaluation
     import sys
     sys.path.insert(1, str(pathlib.Path(f"../../common/")))
-    from rewards import TimeLimitPrimalDualIntegral
-    
-    # create ecole environment
-    env = ec.environment.Configuring(
-          
-          # set time limit for each instance
-          scip_params = {'limits/time' : args.timelimit},
-          
-          # pure bandit, no observation
-          observation_function = None,
-
-          # minimize the primal-dual integral
-          reward_function = TimeLimitPrimalDualIntegral(),
-
-          # collect additional metrics for information purposes
-          information_function = {}
-    )
+    from scip_parameters import ParameterCatalogue, read_pcs
+    from tuning import EcoleRunner, EcoleTargetAlgorithm, IncumbentCostsCallback, split_cpus, warm_start_runhistory
+
+    # in racing mode, the runners read the incumbent's costs from a file of this campaign
+    incumbent_file = pathlib.Path(args.cache) / f"incumbent_{os.getpid()}.json" if args.racing else None
+
+    # in parallel mode, SMAC dispatches runs to dask workers and collects them as they finish
+    if args.jobs > 1:
+        from dask.distributed import Client, LocalCluster
+        dask_client = Client(LocalCluster(n_workers=args.jobs, threads_per_worker=1, processes=True))
+        runner = EcoleRunner(args.timelimit, worker_cpus=split_cpus(args.jobs) if args.pin else None, cache_dir=args.cache, incumbent_file=incumbent_file)
+    else:
+        dask_client = None
+        runner = EcoleRunner(args.timelimit, cache_dir=args.cache, incumbent_file=incumbent_file)
 
     # Build Configuration Space which defines all parameters and their ranges
-    cs = ConfigurationSpace()
-    params = getParamsFromFile('parameters.pcs')
-    cs.add_hyperparameters(params)
+    cs = read_pcs('parameters.pcs', ParameterCatalogue.load())
 
     # Scenario object
     scenario = Scenario({"run_obj": "quality",  # we optimize quality (aka primal-dual integral)
@@ -192,10 +130,24 @@ if __name__ == '__main__':
                          "instance_file": "instances.txt"
                          })
 
-    # optimize with SMAC
-    smac = SMAC4HPO(scenario = scenario, initial_design=RandomConfigurations, tae_runner = runEcole)
+    # resume from the runs of previous campaigns on the same instances
+    runhistory, n_cached_runs = warm_start_runhistory(runner.run_cache, cs, instances, args.timelimit)
+    print(f"Warm-starting SMAC with {n_cached_runs} cached runs from {pathlib.Path(args.cache).resolve()}")
 
-    result = smac.optimize()
+    # optimize with SMAC
+    # runs are not wrapped in a subprocess: SCIP enforces the time limit, and each process keeps
+    # its own environment and instance cache
+    smac = SMAC4HPO(scenario = scenario, initial_design=RandomConfigurations, tae_runner = EcoleTargetAlgorithm,
+                    tae_runner_kwargs = {'ta': runner}, dask_client = dask_client,
+                    runhistory = runhistory)
+    if args.racing:
+        smac.register_callback(IncumbentCostsCallback(incumbent_file))
+
+    try:
+        result = smac.optimize()
+    finally:
+        if incumbent_file is not None and incumbent_file.exists():
+            incumbent_file.unlink()
     result = {k: result[k] for k in result}
 
     print("\n")
@@ -203,3 +155,6 @@ if __name__ == '__main__':
     print("Best parameter settings")
     print("##############################")
     print(result)
+
+    if dask_client is not None:
+        dask_client.close()
@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import hashlib
+import pathlib
+
+import numpy as np
+import pyscipopt
+from smac.tae import StatusType
+from smac.tae.serial_runner import SerialRunner
+from smac.callbacks import IncorporateRunResultCallback
+
+from rewards import TimeLimitPrimalDualIntegral, get_bounds
+from environments import Configuring, parameter_validator
+
+
+def settings_to_action(settings):
+    """Converts a SMAC configuration into a dict of SCIP parameters."""
+    action = {k: settings[k] for k in settings}
+
+    for k in action.keys():
+        if action[k] == 'TRUE':
+            action[k] = True
+        elif action[k] == 'FALSE':
+            action[k] = False
+
+    return action
+
+
+def split_cpus(n_workers):
+    """Splits the CPUs available to this process into one disjoint set per worker."""
+    cpus = sorted(os.sched_getaffinity(0))
+    assert n_workers <= len(cpus), f"Cannot pin {n_workers} workers on {len(cpus)} CPUs."
+    return [set(chunk.tolist()) for chunk in np.array_split(cpus, n_workers)]
+
+
+class RunCache():
+    """
+    Persistent store of the results of SCIP runs, shared by processes and tuning campaigns.
+    Each run is stored as a JSON record, along with its bound trajectory (.npz), both named
+    after a hash of everything the result depends on: SCIP parameters, instance (path and
+    checksum), time limit and seed. A run is only visible once its record is written.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cached runs.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.checksums = {}
+
+    def instance_checksum(self, instance):
+        """SHA-256 of the instance file, only computed again if the file changes."""
+        path = os.path.realpath(instance)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        if key not in self.checksums:
+            with open(path, 'rb') as f:
+                self.checksums[key] = hashlib.sha256(f.read()).hexdigest()
+        return self.checksums[key]
+
+    def key(self, params, instance, time_limit, seed):
+        """Canonical hash of a run: SCIP parameters in sorted order, resolved instance path and checksum, time limit and seed."""
+        description = json.dumps({
+            'params': params,
+            'instance': os.path.realpath(instance),
+            'checksum': self.instance_checksum(instance),
+            'time_limit': float(time_limit),
+            'seed': int(seed),
+        }, sort_keys=True, default=lambda value: value.item())  # numpy scalars
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def record_file(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def trajectory_file(self, key):
+        return self.cache_dir / f"{key}.npz"
+
+    def get(self, key):
+        """Record of a cached run, None if the run is not cached."""
+        try:
+            with open(self.record_file(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, record):
+        """Stores the record of a run, atomically."""
+        tmp_file = self.cache_dir / f"tmp_{key}_{os.getpid()}.json"
+        with open(tmp_file, 'w') as f:
+            json.dump(record, f, default=lambda value: value.item())
+        os.replace(tmp_file, self.record_file(key))
+
+    def records(self):
+        """All cached run records."""
+        for record_file in sorted(self.cache_dir.glob('?' * 64 + '.json')):
+            with open(record_file) as f:
+                yield json.load(f)
+
+
+def warm_start_runhistory(run_cache, configuration_space, instances, time_limit):
+    """
+    Builds a SMAC run history from the cached runs on the given instances and time limit, whose
+    parameters belong to the configuration space, so that a tuning campaign resumes from them.
+
+    Returns
+    -------
+    runhistory : smac.runhistory.runhistory.RunHistory
+        Run history, with the runs recorded as coming from the same instances.
+    n_runs : int
+        Number of cached runs added.
+    """
+    from ConfigSpace import Configuration
+    from smac.runhistory.runhistory import RunHistory, DataOrigin
+
+    # cached runs refer to resolved paths, SMAC to the paths of the instance file
+    instance_ids = {os.path.realpath(instance): str(instance) for instance in instances}
+
+    runhistory = RunHistory()
+    n_runs = 0
+    for record in run_cache.records():
+        if record['instance'] not in instance_ids or record['time_limit'] != time_limit:
+            continue
+        try:
+            config = Configuration(configuration_space, values=record['settings'])
+        except (ValueError, KeyError):
+            continue  # parameters tuned in another campaign
+
+        runhistory.add(config, record['cost'], record['time'], StatusType[record['status']],
+                       instance_id=instance_ids[record['instance']], seed=record['seed'],
+                       origin=DataOrigin.EXTERNAL_SAME_INSTANCES)
+        n_runs += 1
+
+    return runhistory, n_runs
+
+
+class IncumbentCostsCallback(IncorporateRunResultCallback):
+    """
+    SMAC callback, run in the main process after each run result: writes the settings of the
+    current incumbent and its cost on each instance to a JSON file, read by the runners of the
+    racing mode. The cost on an instance is the worst over the incumbent's completed runs on it,
+    so that runs are only cut once they are certainly worse than the incumbent.
+
+    Parameters
+    ----------
+    incumbent_file : str
+        File shared with the runners.
+    """
+
+    def __init__(self, incumbent_file):
+        self.incumbent_file = pathlib.Path(incumbent_file)
+        self.written = None
+
+    def __call__(self, smbo, run_info, result, time_left):
+        runhistory = smbo.runhistory
+        config_id = runhistory.config_ids.get(smbo.incumbent)
+        if config_id is None:
+            return None
+
+        costs = {}
+        for run_key, run_value in runhistory.data.items():
+            if run_key.config_id == config_id and run_value.status == StatusType.SUCCESS:
+                costs[run_key.instance_id] = max(run_value.cost, costs.get(run_key.instance_id, -np.inf))
+
+        incumbent = {'settings': {k: smbo.incumbent[k] for k in smbo.incumbent}, 'costs': costs}
+        if incumbent != self.written:
+            tmp_file = self.incumbent_file.with_name(f"tmp_{self.incumbent_file.name}")
+            with open(tmp_file, 'w') as f:
+                json.dump(incumbent, f, default=lambda value: value.item())
+            os.replace(tmp_file, self.incumbent_file)
+            self.written = incumbent
+
+        return None
+
+
+class RacingEventHandler(pyscipopt.Eventhdlr):
+    """
+    Integrates the primal-dual gap as the solve goes, as TimeLimitPrimalDualIntegral does, and
+    interrupts the solve once the integral exceeds a threshold. The gap of the remaining time
+    is only known to be non-negative, so the integral so far is a lower bound of the final
+    one, which is reported as the (censored) cost of the run.
+
+    Parameters
+    ----------
+    threshold : float
+        Integral above which the solve is interrupted.
+    initial_primal_bound : float
+        Initial primal bound of the instance.
+    initial_dual_bound : float
+        Initial dual bound of the instance.
+    """
+
+    def __init__(self, threshold, initial_primal_bound, initial_dual_bound):
+        self.threshold = threshold
+        self.initial_primal_bound = initial_primal_bound
+        self.initial_dual_bound = initial_dual_bound
+        self.integral = 0
+        self.capped = False
+
+    def gap(self):
+        primal_bound, dual_bound = get_bounds(self.model)
+        if self.model.getObjectiveSense() == "minimize":
+            return min(primal_bound, self.initial_primal_bound) - max(dual_bound, self.initial_dual_bound)
+        else:
+            return min(dual_bound, self.initial_dual_bound) - max(primal_bound, self.initial_primal_bound)
+
+    def eventinit(self):
+        self.last_time = self.model.getSolvingTime()
+        self.last_gap = self.gap()
+        self.model.catchEvent(pyscipopt.SCIP_EVENTTYPE.BESTSOLFOUND, self)
+        self.model.catchEvent(pyscipopt.SCIP_EVENTTYPE.NODESOLVED, self)
+
+    def eventexit(self):
+        self.model.dropEvent(pyscipopt.SCIP_EVENTTYPE.BESTSOLFOUND, self)
+        self.model.dropEvent(pyscipopt.SCIP_EVENTTYPE.NODESOLVED, self)
+
+    def eventexec(self, event):
+        # the gap is constant between two events
+        solving_time = self.model.getSolvingTime()
+        self.integral += self.last_gap * (solving_time - self.last_time)
+        self.last_time = solving_time
+        self.last_gap = self.gap()
+
+        if not self.capped and self.integral > self.threshold:
+            self.capped = True
+            self.model.interruptSolve()
+
+
+class EcoleRunner():
+    """
+    Target algorithm run by SMAC: solves an instance with the given SCIP parameters, and
+    returns the primal-dual integral. The environment is built on first use in each process,
+    so that the runner can be shipped to parallel (dask) workers.
+
+    Parameters
+    ----------
+    time_limit : float
+        Instance time limit (in seconds).
+    worker_cpus : list (optional)
+        CPUs of each dask worker, by worker name. If given, each run is pinned to the CPUs of
+        the worker executing it, so that wall-clock integrals remain comparable.
+    cache_dir : str (optional)
+        Directory of a RunCache. Cached runs are answered without solving, and new runs are
+        stored along with their bound trajectory.
+    incumbent_file : str (optional)
+        File written by an IncumbentCostsCallback. If given, runs race against the incumbent:
+        a run is interrupted once its integral exceeds the one of the incumbent on its instance,
+        and reported as capped.
+    """
+
+    def __init__(self, time_limit, worker_cpus=None, cache_dir=None, incumbent_file=None):
+        self.time_limit = time_limit
+        self.worker_cpus = worker_cpus
+        self.run_cache = RunCache(cache_dir) if cache_dir is not None else None
+        self.incumbent_file = incumbent_file
+        self.env = None
+
+    def __getstate__(self):
+        # the environment is not picklable, it is rebuilt by the receiving process
+        state = self.__dict__.copy()
+        state['env'] = None
+        state.pop('reward_function', None)
+        return state
+
+    def make_environment(self):
+        self.reward_function = TimeLimitPrimalDualIntegral()
+        self.env = Configuring(
+
+            # set time limit for each instance
+            time_limit=self.time_limit,
+
+            # pure bandit, no observation
+            observation_function=None,
+
+            # minimize the primal-dual integral
+            reward_function=self.reward_function,
+
+            # collect additional metrics for information purposes
+            information_function={}
+        )
+
+    def racing_threshold(self, settings, instance):
+        """Integral of the incumbent on the instance, None if there is nothing to race against."""
+        if self.incumbent_file is None:
+            return None
+        try:
+            with open(self.incumbent_file) as f:
+                incumbent = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        # the incumbent itself is never capped
+        if incumbent['settings'] == json.loads(json.dumps(settings, default=lambda value: value.item())):
+            return None
+        return incumbent['costs'].get(str(instance))
+
+    def __call__(self, settings, instance, seed=0):
+        """
+        Returns
+        -------
+        record : dict
+            Run record, whose 'status' is 'CAPPED' if the run was interrupted by racing, in
+            which case its 'cost' is a lower bound of the integral.
+        """
+        settings = {k: settings[k] for k in settings}
+        action = settings_to_action(settings)
+        # invalid settings are rejected before any solver work
+        parameter_validator.validate(action)
+        threshold = self.racing_threshold(settings, instance)
+
+        if self.run_cache is not None:
+            key = self.run_cache.key(action, instance, self.time_limit, seed)
+            record = self.run_cache.get(key)
+            # a capped run only stands if it would be capped again
+            if record is not None and (record['status'] != 'CAPPED' or (threshold is not None and record['cost'] > threshold)):
+                print("Cached Ecole run with instance ", instance)
+                return record
+
+        # pins the worker thread running SCIP
+        if self.worker_cpus is not None:
+            from distributed import get_worker
+            os.sched_setaffinity(0, self.worker_cpus[int(get_worker().name)])
+
+        if self.env is None:
+            self.make_environment()
+
+        print("New Ecole run with instance ", instance)
+
+        # read the instance's initial primal and dual bounds from JSON file
+        with open(pathlib.PosixPath(instance).with_name(pathlib.PosixPath(instance).stem).with_suffix('.json')) as f:
+            instance_info = json.load(f)
+
+        # set up the reward function parameters for that instance
+        self.reward_function.set_parameters(
+                initial_primal_bound=instance_info["primal_bound"],
+                initial_dual_bound=instance_info["dual_bound"],
+                objective_offset=0)
+        self.reward_function.set_trajectory_file(
+                self.run_cache.trajectory_file(key) if self.run_cache is not None else None)
+
+        # start a new episode (the instance is only parsed the first time it is seen, and
+        # copied once from the process' instance cache)
+        start_time = time.time()
+        self.env.seed(seed)
+        self.env.reset(str(instance))
+
+        # race against the incumbent during the solve
+        if threshold is not None:
+            racing = RacingEventHandler(threshold, instance_info["primal_bound"], instance_info["dual_bound"])
+            self.env.model.as_pyscipopt().includeEventhdlr(racing, "racing", "interrupts runs worse than the incumbent")
+
+        # apply the action and collect the reward
+        _, _, reward, _, _ = self.env.step(action)
+
+        capped = threshold is not None and racing.capped
+        record = {
+            'settings': settings,
+            'instance': os.path.realpath(instance),
+            'checksum': self.run_cache.instance_checksum(instance) if self.run_cache is not None else None,
+            'time_limit': self.time_limit,
+            'seed': seed,
+            'cost': racing.integral if capped else reward,
+            'time': time.time() - start_time,
+            'status': 'CAPPED' if capped else 'SUCCESS',
+        }
+        if self.run_cache is not None:
+            self.run_cache.put(key, record)
+
+        return record
+
+
+class EcoleTargetAlgorithm(SerialRunner):
+    """
+    SMAC runner of an EcoleRunner (given as ta), which reports the status of the runs, so that
+    runs interrupted by racing reach SMAC as capped (censored) results.
+    """
+
+    def run(self, config, instance, cutoff=None, seed=12345, budget=None, instance_specific="0"):
+        record = self.ta(config, instance, seed)
+        return StatusType[record['status']], record['cost'], record['time'], {}
@@ -1,11 +1,24 @@
+import os
 import torch
-import ecole as ec
 import numpy as np
 
-from model import GNNPolicy
+from model import load_policy
+from observation import CachedNodeBipartite
+from inference_server import InferenceClient
 
 
-class ObservationFunction(ec.observation.NodeBipartite):
+# NodeBipartite features that do not change within an episode (for a given LP)
+STATIC_ROW_FEATURES = [0, 1]  # bias, objective cosine similarity
+STATIC_COLUMN_FEATURES = [0, 1, 2, 3, 4]  # objective coefficient, variable type
+
+# exported policy to load (see train_files/03_export.py): 'fp32' (original), 'fp16', 'bf16' or 'int8' (CPU only)
+PARAMS_VARIANT = 'fp32'
+
+# Unix socket of a running inference_server.py shared by concurrent episodes, if any (local model otherwise)
+INFERENCE_SERVER = os.environ.get('DUAL_INFERENCE_SERVER')
+
+
+class ObservationFunction(CachedNodeBipartite):
 
     def __init__(self, problem):
         super().__init__()
@@ -19,31 +32,83 @@ class Policy():
     def __init__(self, problem):
         self.rng = np.random.RandomState()
 
-        # get parameters
-        params_path = f'agents/trained_models/{problem}/best_params.pkl'
+        # decisions are taken by the server, which batches them with the ones of other episodes
+        self.client = InferenceClient(INFERENCE_SERVER) if INFERENCE_SERVER else None
+        if self.client is not None:
+            return
+
+        # set up policy, on GPU if available (quantized policies only run on CPU)
+        self.device = "cuda:0" if torch.cuda.is_available() and PARAMS_VARIANT != 'int8' else "cpu"
 
-        # set up policy
-        self.device = f"cuda:0"
-        self.policy = GNNPolicy().to(self.device)
-        self.policy.load_state_dict(torch.load(params_path))
+        # compiled inference model, with PreNorm layers folded and no message passing overhead,
+        # whose static terms are cached (original model for the quantized variant)
+        self.cached = PARAMS_VARIANT != 'int8'
+        self.policy = load_policy(f'agents/trained_models/{problem}', PARAMS_VARIANT, self.device,
+                                  static_constraint_features=STATIC_ROW_FEATURES,
+                                  static_variable_features=STATIC_COLUMN_FEATURES)
+
+        # mask variable features (no incumbent info)
+        self.variable_feature_mask = None
+
+        self.reset_graph()
 
     def seed(self, seed):
         self.rng = np.random.RandomState(seed)
+        self.reset_graph()
+
+    def reset_graph(self):
+        # LP the edge tensors and the model's cache were built for (see CachedNodeBipartite)
+        self.graph = None
+
+    def update_graph(self, graph, observation):
+        """
+        Builds the edge tensors, preallocates the feature tensors, and precomputes the
+        model's static terms, only at the first node of an episode and when the LP changes.
+        The edges of the observation are not even read otherwise.
+        """
+        if graph == self.graph:
+            return
+        self.graph = graph
+
+        edge_indices = observation.edge_features.indices
+        edge_values = observation.edge_features.values
+        self.edge_index = torch.from_numpy(edge_indices.astype(np.int64)).to(self.device)
+        self.edge_attr = torch.from_numpy(edge_values.astype(np.float32)).unsqueeze(-1).to(self.device)
+
+        if self.variable_feature_mask is None:
+            self.variable_feature_mask = np.delete(np.arange(observation.column_features.shape[1]), [13, 14])
+        self.constraint_features = torch.empty(observation.row_features.shape, dtype=torch.float32, device=self.device)
+        self.variable_features = torch.empty((observation.column_features.shape[0], len(self.variable_feature_mask)),
+                                             dtype=torch.float32, device=self.device)
+
+        if not self.cached:
+            return
+        self.copy_features(observation)
+        with torch.no_grad():
+            self.cache = self.policy.precompute(self.constraint_features, self.edge_index, self.edge_attr, self.variable_features)
+
+    def copy_features(self, observation):
+        self.constraint_features.copy_(torch.from_numpy(observation.row_features))
+        self.variable_features.copy_(torch.from_numpy(observation.column_features[:, self.variable_feature_mask]))
 
     def __call__(self, action_set, observation):
-        # mask variable features (no incumbent info)
-        variable_features = observation.column_features
-        variable_features = np.delete(variable_features, 14, axis=1)
-        variable_features = np.delete(variable_features, 13, axis=1)
-
-        constraint_features = torch.FloatTensor(observation.row_features).to(self.device)
-        edge_index = torch.LongTensor(observation.edge_features.indices.astype(np.int64)).to(self.device)
-        edge_attr = torch.FloatTensor(np.expand_dims(observation.edge_features.values, axis=-1)).to(self.device)
-        variable_features = torch.FloatTensor(variable_features).to(self.device)
-        action_set = torch.LongTensor(np.array(action_set, dtype=np.int64)).to(self.device)
-
-        logits = self.policy(constraint_features, edge_index, edge_attr, variable_features)
-        logits = logits[action_set]
+        graph, observation = observation
+        if self.client is not None:
+            return self.client(action_set, observation)
+
+        self.update_graph(graph, observation)
+
+        # only node features are copied to the (preallocated) tensors at each node,
+        # and only their dynamic part goes through the model
+        self.copy_features(observation)
+        action_set = torch.from_numpy(np.asarray(action_set, dtype=np.int64)).to(self.device)
+
+        # the output head is only evaluated on the candidate variables
+        with torch.no_grad():
+            if self.cached:
+                logits = self.policy.forward_cached(self.cache, self.constraint_features, self.variable_features, action_set)
+            else:
+                logits = self.policy(self.constraint_features, self.edge_index, self.edge_attr, self.variable_features, action_set)
         action_idx = logits.argmax().item()
         action = action_set[action_idx]
 
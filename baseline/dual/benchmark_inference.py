@@ -0,0 +1,118 @@
+import time
+import argparse
+import numpy as np
+import torch
+
+from model import GNNPolicy, FusedGNNPolicy
+
+
+def benchmark(policy, inputs, n_decisions):
+    """
+    Times the policy's forward pass on the given inputs.
+
+    Parameters
+    ----------
+    policy : callable
+        Policy to benchmark.
+    inputs : tuple
+        (constraint_features, edge_indices, edge_features, variable_features)
+    n_decisions : int
+        Number of timed forward passes, after a few warm-up passes.
+
+    Returns
+    -------
+    latencies : np.ndarray
+        Latency of each decision, in milliseconds.
+    """
+    latencies = []
+    with torch.no_grad():
+        for i in range(n_decisions + 5):
+            start = time.perf_counter()
+            policy(*inputs).argmax().item()  # includes the device synchronization
+            if i >= 5:
+                latencies.append((time.perf_counter() - start) * 1000)
+    return np.asarray(latencies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-p', '--params',
+        help='Trained parameters to load (random parameters otherwise).',
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        '-c', '--ncons',
+        help='Number of constraints.',
+        type=int,
+        default=2000,
+    )
+    parser.add_argument(
+        '-v', '--nvars',
+        help='Number of variables.',
+        type=int,
+        default=2000,
+    )
+    parser.add_argument(
+        '-e', '--nedges',
+        help='Number of edges (non-zero coefficients).',
+        type=int,
+        default=50000,
+    )
+    parser.add_argument(
+        '-n', '--ndecisions',
+        help='Number of timed decisions.',
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        '-g', '--gpu',
+        help='Run on CUDA GPU 0 if available.',
+        action='store_true',
+    )
+    args = parser.parse_args()
+
+    device = "cuda:0" if args.gpu and torch.cuda.is_available() else "cpu"
+
+    policy = GNNPolicy()
+    if args.params is not None:
+        policy.load_state_dict(torch.load(args.params, map_location="cpu"))
+    policy.eval()
+    fused_policy = torch.jit.script(FusedGNNPolicy(policy))
+
+    # random bipartite graph of the requested size
+    rng = np.random.RandomState(0)
+    inputs = (
+        torch.FloatTensor(rng.randn(args.ncons, 5)),
+        torch.LongTensor(np.stack([rng.randint(args.ncons, size=args.nedges), rng.randint(args.nvars, size=args.nedges)])),
+        torch.FloatTensor(rng.randn(args.nedges, 1)),
+        torch.FloatTensor(rng.randn(args.nvars, 17)),
+    )
+    inputs = tuple(x.to(device) for x in inputs)
+
+    # per-node inputs of the cached model, with new values for the dynamic features
+    constraint_features, edge_indices, edge_features, variable_features = inputs
+    node_constraint_features = constraint_features.clone()
+    node_constraint_features[:, 2:] = torch.randn(args.ncons, 3)
+    node_variable_features = variable_features.clone()
+    node_variable_features[:, 5:] = torch.randn(args.nvars, 12)
+    node_inputs = (node_constraint_features, edge_indices, edge_features, node_variable_features)
+
+    print(f"{args.ncons} constraints, {args.nvars} variables, {args.nedges} edges, on {device}")
+    with torch.no_grad():
+        policy, fused_policy = policy.to(device), fused_policy.to(device)
+        cache = fused_policy.precompute(*inputs)
+        reference = policy(*node_inputs)
+        fused_error = (reference - fused_policy(*node_inputs)).abs().max().item()
+        cached_error = (reference - fused_policy.forward_cached(cache, node_constraint_features, node_variable_features)).abs().max().item()
+    print(f"max absolute logit difference: fused {fused_error:.3g}, cached {cached_error:.3g}")
+    assert max(fused_error, cached_error) < 1e-4, "the fused model does not match the original one"
+
+    def cached_policy(constraint_features, edge_indices, edge_features, variable_features):
+        return fused_policy.forward_cached(cache, constraint_features, variable_features)
+
+    for name, model in [('eager', policy), ('fused', fused_policy), ('cached', cached_policy)]:
+        latencies = benchmark(model, node_inputs, args.ndecisions)
+        print(f"{name:>6}: mean {latencies.mean():8.3f} ms, p50 {np.percentile(latencies, 50):8.3f} ms, "
+              f"p90 {np.percentile(latencies, 90):8.3f} ms per decision")
@@ -0,0 +1,282 @@
+import time
+import queue
+import argparse
+import threading
+import traceback
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+import torch
+
+from model import load_policy, POLICY_VARIANTS
+
+
+# variable features holding incumbent information, masked from the policy's inputs
+INCUMBENT_FEATURES = [13, 14]
+
+
+class InferenceError(RuntimeError):
+    """
+    Failure of the server on a request, sent in place of its answer and raised by the client.
+    """
+    pass
+
+
+class InferenceClient:
+    """
+    Connection of a branching episode to an InferenceServer. One client per thread or
+    process, since requests are answered in order on each connection.
+
+    Parameters
+    ----------
+    address : str
+        Unix socket of the server.
+    """
+    def __init__(self, address):
+        self.connection = Client(address, family='AF_UNIX')
+
+    def __call__(self, action_set, observation):
+        """
+        Queries the branching decision of the served policy.
+
+        Parameters
+        ----------
+        action_set : np.ndarray
+            Candidate variables.
+        observation : ecole.observation.NodeBipartiteObs
+            Node observation, with incumbent features.
+
+        Returns
+        -------
+        action : int
+            Chosen candidate variable.
+
+        Raises
+        ------
+        InferenceError
+            If the server failed to run the policy on this request.
+        """
+        self.connection.send((
+            observation.row_features,
+            observation.edge_features.indices,
+            observation.edge_features.values,
+            np.delete(observation.column_features, INCUMBENT_FEATURES, axis=1),
+            np.asarray(action_set, dtype=np.int64),
+        ))
+        action = self.connection.recv()
+        if isinstance(action, InferenceError):
+            raise action
+        return action
+
+    def close(self):
+        self.connection.close()
+
+
+class InferenceServer:
+    """
+    Serves the branching decisions of a dual policy to concurrent episodes, over a Unix
+    socket. Requests of all connections are gathered into mini-batches, in the same layout
+    as torch_geometric mini-batches (concatenated nodes, offset edges and candidates),
+    of at most max_batch_size graphs. A batch is run as soon as it is full, or once
+    max_delay seconds have passed since its first request arrived. If a batch fails, its
+    requests are run one by one, and the ones that still fail are answered with an
+    InferenceError, so that a bad request never stalls the other episodes.
+
+    Parameters
+    ----------
+    policy : torch.nn.Module
+        Inference model, see model.load_policy.
+    address : str
+        Unix socket on which to listen.
+    device : str
+        Device of the model.
+    max_batch_size : int
+        Maximum number of graphs in a batch.
+    max_delay : float
+        Maximum time a request waits for other requests, in seconds.
+    """
+    def __init__(self, policy, address, device='cpu', max_batch_size=32, max_delay=0.005):
+        self.policy = policy
+        self.address = address
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.requests = queue.SimpleQueue()
+
+        # per batch size: number of batches, time spent in the model, latency of each request
+        self.n_batches = {}
+        self.batch_times = {}
+        self.latencies = {}
+
+    def serve_forever(self):
+        """
+        Accepts connections until interrupted, then prints the statistics of the batches.
+        """
+        threading.Thread(target=self.run_batches, daemon=True).start()
+        with Listener(self.address, family='AF_UNIX') as listener:
+            print(f"Serving on {self.address} (batches of at most {self.max_batch_size}, "
+                  f"{self.max_delay * 1000:.1f} ms delay, on {self.device})")
+            try:
+                while True:
+                    connection = listener.accept()
+                    threading.Thread(target=self.receive, args=(connection,), daemon=True).start()
+            except KeyboardInterrupt:
+                pass
+        print(self.report())
+
+    def receive(self, connection):
+        """
+        Queues the requests of one connection, until it is closed.
+        """
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, OSError):
+                break
+            self.requests.put((connection, request, time.perf_counter()))
+        connection.close()
+
+    def run_batches(self):
+        """
+        Batching loop: waits for a first request, gathers the following ones until the batch
+        is full or its deadline has passed, then answers all of them at once.
+        """
+        with torch.no_grad():
+            while True:
+                batch = [self.requests.get()]
+                deadline = batch[0][2] + self.max_delay
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(self.requests.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+
+                start_time = time.perf_counter()
+                actions = self.decide_safely([request for _, request, _ in batch])
+                batch_time = time.perf_counter() - start_time
+
+                for (connection, _, arrival_time), action in zip(batch, actions):
+                    try:
+                        connection.send(action)
+                    except OSError:
+                        pass  # the episode was interrupted
+                    self.latencies.setdefault(len(batch), []).append(time.perf_counter() - arrival_time)
+                self.n_batches[len(batch)] = self.n_batches.get(len(batch), 0) + 1
+                self.batch_times[len(batch)] = self.batch_times.get(len(batch), 0) + batch_time
+
+    def decide_safely(self, requests):
+        """
+        Runs the policy on a batch of requests, then on each request alone if the batch
+        fails. Failed requests are logged, and their action is an InferenceError.
+        """
+        try:
+            return self.decide(requests)
+        except Exception:
+            if len(requests) == 1:
+                traceback.print_exc()
+                return [InferenceError(traceback.format_exc())]
+        return [self.decide_safely([request])[0] for request in requests]
+
+    def decide(self, requests):
+        """
+        Runs the policy on a batch of requests.
+
+        Parameters
+        ----------
+        requests : list
+            (constraint_features, edge_indices, edge_features, variable_features, candidates)
+            of each graph.
+
+        Returns
+        -------
+        actions : list
+            Candidate variable of highest logit, for each graph.
+        """
+        constraint_features, edge_indices, edge_features, variable_features, candidates = zip(*requests)
+
+        # offset the node indices of each graph, as in torch_geometric mini-batches
+        row_offsets = np.cumsum([0] + [len(features) for features in constraint_features[:-1]])
+        col_offsets = np.cumsum([0] + [len(features) for features in variable_features[:-1]])
+        edge_offsets = np.stack([row_offsets, col_offsets], axis=1)[:, :, None]
+
+        inputs = (
+            np.concatenate(constraint_features).astype(np.float32, copy=False),
+            np.concatenate([indices.astype(np.int64) + offsets for indices, offsets in zip(edge_indices, edge_offsets)], axis=1),
+            np.concatenate(edge_features).astype(np.float32, copy=False)[:, None],
+            np.concatenate(variable_features).astype(np.float32, copy=False),
+            np.concatenate([cands + offset for cands, offset in zip(candidates, col_offsets)]),
+        )
+        inputs = [torch.from_numpy(array).to(self.device) for array in inputs]
+
+        logits = self.policy(*inputs).cpu().numpy()
+        logits = np.split(logits, np.cumsum([len(cands) for cands in candidates[:-1]]))
+        return [int(cands[graph_logits.argmax()]) for cands, graph_logits in zip(candidates, logits)]
+
+    def report(self):
+        """
+        Throughput and latency percentiles of the requests, per batch size.
+        """
+        lines = [f"{'batch size':>10} {'batches':>8} {'decisions/s':>12} {'p50 (ms)':>9} {'p90 (ms)':>9} {'p99 (ms)':>9}"]
+        for batch_size in sorted(self.n_batches):
+            n_batches = self.n_batches[batch_size]
+            latencies = np.asarray(self.latencies[batch_size]) * 1000
+            throughput = n_batches * batch_size / self.batch_times[batch_size]
+            lines.append(f"{batch_size:>10} {n_batches:>8} {throughput:>12.1f} {np.percentile(latencies, 50):>9.3f} "
+                         f"{np.percentile(latencies, 90):>9.3f} {np.percentile(latencies, 99):>9.3f}")
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'problem',
+        help='MILP instance type to process.',
+        choices=['item_placement', 'load_balancing', 'anonymous'],
+    )
+    parser.add_argument(
+        '-a', '--address',
+        help='Unix socket on which to listen.',
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        '-p', '--params',
+        help='Directory of the trained parameters.',
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        '-v', '--variant',
+        help='Exported policy variant to serve.',
+        choices=list(POLICY_VARIANTS),
+        default='fp32',
+    )
+    parser.add_argument(
+        '-b', '--batch_size',
+        help='Maximum number of graphs per batch.',
+        type=int,
+        default=32,
+    )
+    parser.add_argument(
+        '-d', '--delay',
+        help='Maximum time a request waits for other requests, in milliseconds.',
+        type=float,
+        default=5,
+    )
+    parser.add_argument(
+        '-g', '--gpu',
+        help='Run on CUDA GPU 0 if available.',
+        action='store_true',
+    )
+    args = parser.parse_args()
+
+    address = args.address or f'/tmp/dual_{args.problem}.sock'
+    params_dir = args.params or f'agents/trained_models/{args.problem}'
+    device = "cuda:0" if args.gpu and torch.cuda.is_available() and args.variant != 'int8' else "cpu"
+
+    policy = load_policy(params_dir, args.variant, device)
+    server = InferenceServer(policy, address, device, args.batch_size, args.delay / 1000)
+    server.serve_forever()
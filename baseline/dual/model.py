@@ -17,12 +17,15 @@ class PreNormLayer(torch.nn.Module):
         self.n_units = n_units
         self.waiting_updates = False
         self.received_updates = False
+        self.streaming = False
 
     def forward(self, input_):
         if self.waiting_updates:
             self.update_stats(input_)
             self.received_updates = True
-            raise PreNormException
+            if not self.streaming:
+                raise PreNormException
+            return self.normalize(input_)
 
         if self.shift is not None:
             input_ = input_ + self.shift
@@ -32,13 +35,31 @@ class PreNormLayer(torch.nn.Module):
 
         return input_
 
-    def start_updates(self):
+    def start_updates(self, streaming=False):
+        """
+        Starts pre-training for that layer. In streaming mode, the layer does not interrupt
+        the forward pass, and passes its input on normalized by its current statistics.
+        """
         self.avg = 0
         self.var = 0
         self.m2 = 0
         self.count = 0
         self.waiting_updates = True
         self.received_updates = False
+        self.streaming = streaming
+
+    def normalize(self, input_):
+        """
+        Normalizes an input with the current statistics, as the layer will once they are fixed.
+        """
+        if self.shift is not None:
+            input_ = input_ - self.avg
+
+        if self.scale is not None:
+            var = torch.where(self.var < 1e-8, torch.ones_like(self.var), self.var)
+            input_ = input_ / torch.sqrt(var)
+
+        return input_
 
     def update_stats(self, input_):
         """
@@ -128,10 +149,18 @@ class BaseModel(torch.nn.Module):
     Our base model class, which implements pre-training methods.
     """
 
-    def pre_train_init(self):
+    def pre_train_init(self, streaming=False):
+        """
+        Starts pre-training all PreNorm layers. By default, the forward pass stops at the first
+        layer still waiting for updates, and the layers are pre-trained one pass over the data
+        at a time (see pre_train_next). In streaming mode, all layers are updated at once, each
+        passing its input on normalized by its running statistics, so that a single pass over
+        the data pre-trains them all, downstream layers seeing slightly less normalized inputs
+        at the start of the pass.
+        """
         for module in self.modules():
             if isinstance(module, PreNormLayer):
-                module.start_updates()
+                module.start_updates(streaming)
 
     def pre_train_next(self):
         for module in self.modules():
@@ -189,7 +218,11 @@ class GNNPolicy(BaseModel):
             torch.nn.Linear(emb_size, 1, bias=False),
         )
 
-    def forward(self, constraint_features, edge_indices, edge_features, variable_features):
+    def forward(self, constraint_features, edge_indices, edge_features, variable_features, candidates=None):
+        """
+        Computes the logits of all variables, or only of the candidate variables if their
+        indices are given, in which case the output head is only evaluated on those.
+        """
         reversed_edge_indices = torch.stack([edge_indices[1], edge_indices[0]], dim=0)
 
         constraint_features = self.cons_embedding(constraint_features)
@@ -199,5 +232,240 @@ class GNNPolicy(BaseModel):
         constraint_features = self.conv_v_to_c(variable_features, reversed_edge_indices, edge_features, constraint_features)
         variable_features = self.conv_c_to_v(constraint_features, edge_indices, edge_features, variable_features)
 
+        if candidates is not None:
+            variable_features = variable_features[candidates]
         output = self.output_module(variable_features).squeeze(-1)
         return output
+
+
+def fold_prenorm(prenorm, linear):
+    """
+    Returns the weight and bias of a linear layer applied after a PreNorm layer,
+    i.e. W((x + shift) * scale) + b = W' x + b'.
+    """
+    weight, bias = linear.weight, linear.bias if linear.bias is not None else torch.zeros(linear.out_features)
+    shift = prenorm.shift if prenorm.shift is not None else torch.zeros(prenorm.n_units)
+    scale = prenorm.scale if prenorm.scale is not None else torch.ones(prenorm.n_units)
+    return weight * scale, bias + weight @ (shift * scale).expand(weight.shape[1])
+
+
+class FusedBipartiteGraphConvolution(torch.nn.Module):
+    """
+    Inference-only version of a trained BipartiteGraphConvolution, without message
+    passing overhead. PreNorm layers are folded into the adjacent linear layers, node
+    projections are computed once per node rather than once per edge, and since the
+    final message layer is linear it is applied after the aggregation.
+    The terms that only depend on the graph (edge term of the messages, node degrees)
+    can be computed once with precompute(), and reused with forward_cached().
+    """
+    def __init__(self, conv, edge_prenorm):
+        super().__init__()
+        with torch.no_grad():
+            # the scales of both PreNorm layers are positive, so they commute with the ReLU
+            final_prenorm, _, final_linear = conv.feature_module_final
+            post_prenorm, = conv.post_conv_module
+            output_linear = conv.output_module[0]
+            emb_size = final_linear.in_features
+
+            edge_weight, edge_bias = fold_prenorm(edge_prenorm, conv.feature_module_edge[0])
+            self.left_weight = torch.nn.Parameter(conv.feature_module_left[0].weight.clone(), requires_grad=False)
+            self.edge_weight = torch.nn.Parameter(edge_weight.squeeze(-1), requires_grad=False)
+            self.edge_bias = torch.nn.Parameter(conv.feature_module_left[0].bias + edge_bias, requires_grad=False)
+            self.right_weight = torch.nn.Parameter(conv.feature_module_right[0].weight.clone(), requires_grad=False)
+            self.final_weight = torch.nn.Parameter(final_linear.weight * final_prenorm.scale, requires_grad=False)
+            self.final_bias = torch.nn.Parameter(final_linear.bias.clone(), requires_grad=False)
+
+            output_weight = output_linear.weight.clone()
+            output_weight[:, :emb_size] *= post_prenorm.scale
+            self.output_weight = torch.nn.Parameter(output_weight, requires_grad=False)
+            self.output_bias = torch.nn.Parameter(output_linear.bias.clone(), requires_grad=False)
+            self.output_module = torch.nn.Sequential(*list(conv.output_module)[1:])
+
+    def forward(self, left_features, edge_indices, edge_features, right_features):
+        cache = self.precompute(edge_indices, edge_features, right_features.shape[0])
+        return self.forward_cached(cache, left_features, right_features)
+
+    @torch.jit.export
+    def precompute(self, edge_indices, edge_features, n_right: int):
+        # type: (Tensor, Tensor, int) -> List[Tensor]
+        source, target = edge_indices[0], edge_indices[1]
+        edge_messages = torch.addcmul(self.edge_bias, edge_features, self.edge_weight)
+        degrees = torch.bincount(target, minlength=n_right).to(edge_messages.dtype).unsqueeze(-1)
+        return [source, target, edge_messages, degrees]
+
+    @torch.jit.export
+    def forward_cached(self, cache, left_features, right_features):
+        # type: (List[Tensor], Tensor, Tensor) -> Tensor
+        source, target, edge_messages, degrees = cache[0], cache[1], cache[2], cache[3]
+
+        # message from left node j to right node i: left(x_i) + edge(e_ij) + right(x_j)
+        # (computed in place, per-edge tensors dominate the cost on large graphs)
+        messages = F.linear(right_features, self.left_weight).index_select(0, target)
+        messages += F.linear(left_features, self.right_weight).index_select(0, source)
+        messages += edge_messages
+        messages.relu_()
+
+        aggregated = torch.zeros(right_features.shape[0], messages.shape[1], dtype=messages.dtype, device=messages.device)
+        aggregated.index_add_(0, target, messages)
+        output = F.linear(aggregated, self.final_weight) + degrees * self.final_bias
+
+        output = F.linear(torch.cat([output, right_features], dim=-1), self.output_weight, self.output_bias)
+        return self.output_module(output)
+
+
+class FusedGNNPolicy(torch.nn.Module):
+    """
+    Inference-only version of a trained GNNPolicy, with the same outputs. PreNorm layers
+    are folded into the adjacent linear layers, and graph convolutions are replaced by
+    their fused counterpart. Can be compiled with torch.jit.script, and converted to half
+    precision with .to(dtype), in which case inputs and outputs remain in single precision.
+
+    Within an episode, the graph and some node features do not change from one node to
+    the next. precompute() computes once the terms that only depend on those, and
+    forward_cached() then only processes the dynamic features at each node.
+
+    Parameters
+    ----------
+    policy : GNNPolicy
+        Trained policy.
+    static_constraint_features : list
+        Constraint features that are constant within an episode (by default, the bias
+        and objective cosine similarity of ecole's NodeBipartite row features).
+    static_variable_features : list
+        Variable features that are constant within an episode (by default, the objective
+        coefficient and type of ecole's NodeBipartite column features).
+    """
+    def __init__(self, policy, static_constraint_features=(0, 1), static_variable_features=(0, 1, 2, 3, 4)):
+        super().__init__()
+        with torch.no_grad():
+            cons_weight, cons_bias = fold_prenorm(policy.cons_embedding[0], policy.cons_embedding[1])
+            var_weight, var_bias = fold_prenorm(policy.var_embedding[0], policy.var_embedding[1])
+
+            # first embedding layers, split between static and dynamic input features
+            cons_static = torch.zeros(cons_weight.shape[1])
+            cons_static[list(static_constraint_features)] = 1
+            var_static = torch.zeros(var_weight.shape[1])
+            var_static[list(static_variable_features)] = 1
+
+            self.cons_static_weight = torch.nn.Parameter(cons_weight * cons_static, requires_grad=False)
+            self.cons_dynamic_weight = torch.nn.Parameter(cons_weight * (1 - cons_static), requires_grad=False)
+            self.cons_bias = torch.nn.Parameter(cons_bias, requires_grad=False)
+            self.var_static_weight = torch.nn.Parameter(var_weight * var_static, requires_grad=False)
+            self.var_dynamic_weight = torch.nn.Parameter(var_weight * (1 - var_static), requires_grad=False)
+            self.var_bias = torch.nn.Parameter(var_bias, requires_grad=False)
+
+        self.cons_embedding = torch.nn.Sequential(*list(policy.cons_embedding)[2:])
+        self.var_embedding = torch.nn.Sequential(*list(policy.var_embedding)[2:])
+        self.conv_v_to_c = FusedBipartiteGraphConvolution(policy.conv_v_to_c, policy.edge_embedding[0])
+        self.conv_c_to_v = FusedBipartiteGraphConvolution(policy.conv_c_to_v, policy.edge_embedding[0])
+        self.output_module = policy.output_module
+        self.eval()
+
+    def forward(self, constraint_features, edge_indices, edge_features, variable_features, candidates=None):
+        # type: (Tensor, Tensor, Tensor, Tensor, Optional[Tensor]) -> Tensor
+        cache = self.precompute(constraint_features, edge_indices, edge_features, variable_features)
+        return self.forward_cached(cache, constraint_features, variable_features, candidates)
+
+    @torch.jit.export
+    def precompute(self, constraint_features, edge_indices, edge_features, variable_features):
+        # type: (Tensor, Tensor, Tensor, Tensor) -> List[Tensor]
+        dtype = self.cons_bias.dtype
+        constraint_features = constraint_features.to(dtype)
+        edge_features = edge_features.to(dtype)
+        variable_features = variable_features.to(dtype)
+        reversed_edge_indices = torch.stack([edge_indices[1], edge_indices[0]], dim=0)
+
+        cache = [F.linear(constraint_features, self.cons_static_weight, self.cons_bias),
+                 F.linear(variable_features, self.var_static_weight, self.var_bias)]
+        cache += self.conv_v_to_c.precompute(reversed_edge_indices, edge_features, constraint_features.shape[0])
+        cache += self.conv_c_to_v.precompute(edge_indices, edge_features, variable_features.shape[0])
+        return cache
+
+    @torch.jit.export
+    def forward_cached(self, cache, constraint_features, variable_features, candidates=None):
+        # type: (List[Tensor], Tensor, Tensor, Optional[Tensor]) -> Tensor
+        dtype = self.cons_bias.dtype
+        constraint_features = self.cons_embedding(cache[0] + F.linear(constraint_features.to(dtype), self.cons_dynamic_weight))
+        variable_features = self.var_embedding(cache[1] + F.linear(variable_features.to(dtype), self.var_dynamic_weight))
+
+        constraint_features = self.conv_v_to_c.forward_cached(cache[2:6], variable_features, constraint_features)
+        variable_features = self.conv_c_to_v.forward_cached(cache[6:10], constraint_features, variable_features)
+
+        if candidates is not None:
+            variable_features = variable_features.index_select(0, candidates)
+        output = self.output_module(variable_features).squeeze(-1)
+        return output.float()
+
+
+# precision of the exported policies, and the corresponding suffix of their parameter files
+POLICY_VARIANTS = {
+    'fp32': torch.float32,
+    'fp16': torch.float16,
+    'bf16': torch.bfloat16,
+    'int8': torch.qint8,  # dynamically quantized linear layers, CPU only
+}
+
+
+def params_file(params_dir, variant='fp32'):
+    """
+    Path of the parameters of a policy variant, best_params.pkl for the original policy.
+    """
+    return f'{params_dir}/best_params.pkl' if variant == 'fp32' else f'{params_dir}/best_params_{variant}.pkl'
+
+
+def convert_policy(policy, variant):
+    """
+    Converts a trained GNNPolicy to the given variant, whose state dict can then be saved.
+
+    Parameters
+    ----------
+    policy : GNNPolicy
+        Trained policy (modified in place, except for the int8 variant).
+    variant : str
+        One of POLICY_VARIANTS.
+
+    Returns
+    -------
+    policy : GNNPolicy
+        Converted policy.
+    """
+    if variant == 'int8':
+        return torch.quantization.quantize_dynamic(policy, {torch.nn.Linear}, dtype=torch.qint8)
+    return policy.to(POLICY_VARIANTS[variant])
+
+
+def load_policy(params_dir, variant='fp32', device='cpu', **kwargs):
+    """
+    Loads the parameters of a policy variant, and builds the corresponding inference model.
+    All variants take single precision inputs and return single precision logits. The int8
+    variant is a quantized GNNPolicy that runs on CPU, the others are compiled FusedGNNPolicy
+    models of the corresponding precision.
+
+    Parameters
+    ----------
+    params_dir : str
+        Directory of the parameter files.
+    variant : str
+        One of POLICY_VARIANTS.
+    device : str
+        Device of the model, ignored for the int8 variant.
+    **kwargs
+        Static feature lists passed to FusedGNNPolicy.
+
+    Returns
+    -------
+    policy : torch.nn.Module
+        Inference model, in evaluation mode.
+    """
+    state_dict = torch.load(params_file(params_dir, variant), map_location="cpu")
+    policy = GNNPolicy()
+    if variant == 'int8':
+        # quantized layers have to be set up before their packed parameters can be loaded
+        policy = convert_policy(policy, variant)
+        policy.load_state_dict(state_dict)
+        return policy.eval()
+
+    # folding is done in single precision, before the conversion
+    policy.load_state_dict(state_dict)
+    policy = torch.jit.script(FusedGNNPolicy(policy, **kwargs))
+    return policy.to(device=device, dtype=POLICY_VARIANTS[variant])
@@ -0,0 +1,48 @@
+import itertools
+
+import ecole
+
+
+class CachedNodeBipartite():
+    """
+    NodeBipartite observation function, whose static parts (edges, static row and column
+    features) are only extracted from SCIP at the first node of an episode, as long as the
+    LP keeps the rows it had there. Observations are (graph, observation) pairs, where graph
+    identifies the LP the edges belong to: it changes at each episode, and at each node once
+    the LP rows have changed, so that consumers only rebuild what they derive from the edges
+    when it changes.
+
+    The static parts are cached by Ecole's NodeBipartite (cache=True), which is only valid while
+    the LP has the rows of the first node. Rows only enter the LP as cuts, and leave it by
+    being removed, so the cache is used while SCIP's number of applied cuts and number of LP
+    rows are the ones of the first node. Once a cut is applied, all following nodes are
+    extracted in full.
+    """
+
+    def __init__(self):
+        self.cached = ecole.observation.NodeBipartite(cache=True)
+        self.full = ecole.observation.NodeBipartite()
+        self.graphs = itertools.count()
+        self.graph = None
+        self.first_lp = None  # (applied cuts, LP rows) at the first node of the episode
+
+    def before_reset(self, model):
+        self.cached.before_reset(model)
+        self.full.before_reset(model)
+        self.first_lp = None
+
+    def extract(self, model, done):
+        if done:
+            return None
+
+        pyscipopt_model = model.as_pyscipopt()
+        lp = (pyscipopt_model.getNCutsApplied(), pyscipopt_model.getNLPRows())
+        if self.first_lp is None:
+            self.first_lp = lp
+            self.graph = next(self.graphs)
+        if lp == self.first_lp:
+            observation = self.cached.extract(model, done)
+        else:
+            observation = self.full.extract(model, done)
+            self.graph = next(self.graphs)
+        return self.graph, observation
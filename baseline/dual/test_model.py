@@ -0,0 +1,56 @@
+import pytest
+import torch
+
+from model import GNNPolicy, FusedGNNPolicy
+
+
+def random_graph(n_cons=6, n_vars=8, n_edges=20):
+    edges = torch.randperm(n_cons * n_vars)[:n_edges]
+    edge_indices = torch.stack([edges // n_vars, edges % n_vars], dim=0)
+    return (torch.randn(n_cons, 5), edge_indices, torch.randn(n_edges, 1), torch.randn(n_vars, 17))
+
+
+def with_new_dynamic_features(constraint_features, variable_features):
+    # a later node of the same episode: only the dynamic features change
+    constraint_features, variable_features = constraint_features.clone(), variable_features.clone()
+    constraint_features[:, 2:] = torch.randn_like(constraint_features[:, 2:])
+    variable_features[:, 5:] = torch.randn_like(variable_features[:, 5:])
+    return constraint_features, variable_features
+
+
+@pytest.fixture
+def policy():
+    torch.manual_seed(0)
+    policy = GNNPolicy()
+
+    # non-trivial PreNorm statistics, so that their folding is checked too
+    policy.pre_train_init(streaming=True)
+    for _ in range(4):
+        policy.pre_train(*random_graph())
+    while policy.pre_train_next() is not None:
+        pass
+    return policy.eval()
+
+
+@pytest.mark.parametrize('candidates', [None, torch.tensor([1, 4, 7])])
+def test_fused_policy_matches_eager(policy, candidates):
+    fused = FusedGNNPolicy(policy)
+    scripted = torch.jit.script(FusedGNNPolicy(policy))
+    constraint_features, edge_indices, edge_features, variable_features = random_graph()
+    cache = fused.precompute(constraint_features, edge_indices, edge_features, variable_features)
+    scripted_cache = scripted.precompute(constraint_features, edge_indices, edge_features, variable_features)
+
+    for _ in range(3):
+        with torch.no_grad():
+            expected = policy(constraint_features, edge_indices, edge_features, variable_features, candidates)
+            outputs = {
+                'fused': fused(constraint_features, edge_indices, edge_features, variable_features, candidates),
+                'scripted': scripted(constraint_features, edge_indices, edge_features, variable_features, candidates),
+                'cached': fused.forward_cached(cache, constraint_features, variable_features, candidates),
+                'scripted cached': scripted.forward_cached(scripted_cache, constraint_features, variable_features, candidates),
+            }
+        for name, output in outputs.items():
+            assert output.shape == expected.shape, name
+            torch.testing.assert_close(output, expected, rtol=0, atol=1e-5, msg=lambda m: f"{name}: {m}")
+
+        constraint_features, variable_features = with_new_dynamic_features(constraint_features, variable_features)
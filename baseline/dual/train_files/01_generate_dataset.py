@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import glob
 import gzip
 import json
@@ -9,12 +10,17 @@ import pickle
 import shutil
 import argparse
 import threading
+import multiprocessing
 import numpy as np
 from pathlib import Path
 
+from shards import ShardWriter, list_shards, load_shard, truncate_shard
+
 # import environment
 sys.path.append('../..')
+sys.path.append('.')
 from common.environments import Branching as Environment
+from observation import CachedNodeBipartite
 
 
 class ExploreThenStrongBranch:
@@ -27,9 +33,12 @@ class ExploreThenStrongBranch:
     ----------
     expert_probability : float in [0, 1]
         Probability of running the expert strategy and collecting samples.
+    seed : int (optional)
+        Seed of the random generator deciding when to query the expert.
     """
-    def __init__(self, expert_probability):
+    def __init__(self, expert_probability, seed=None):
         self.expert_probability = expert_probability
+        self.rng = np.random.RandomState(seed)
         self.pseudocosts_function = ecole.observation.Pseudocosts()
         self.strong_branching_function = ecole.observation.StrongBranchingScores()
 
@@ -65,7 +74,7 @@ class ExploreThenStrongBranch:
             Flag indicating whether scores are given by the expert.
         """
         probabilities = [1-self.expert_probability, self.expert_probability]
-        expert_chosen = bool(np.random.choice(np.arange(2), p=probabilities))
+        expert_chosen = bool(self.rng.choice(np.arange(2), p=probabilities))
         if expert_chosen:
             return (self.strong_branching_function.extract(model,done), True)
         else:
@@ -103,34 +112,64 @@ def send_orders(orders_queue, instances, seed, query_expert_prob, time_limit, ou
             instance_info = json.load(f)
         initial_primal_bound = instance_info["primal_bound"]
         seed = rng.randint(2**32)
-        orders_queue.put([episode, instance, initial_primal_bound, seed, query_expert_prob, time_limit, out_dir])
+        order = [episode, instance, initial_primal_bound, seed, query_expert_prob, time_limit, out_dir]
+        # never block for good on a full queue, so that the dispatcher can be stopped
+        while not stop_flag.is_set():
+            try:
+                orders_queue.put(order, timeout=0.1)
+                break
+            except queue.Full:
+                continue
         episode += 1
 
 
-def make_samples(in_queue, out_queue, stop_flag):
+def make_samples(in_queue, out_queue, stop_flag, server_address=None, sample_format='pickle'):
     """
     Worker loop: fetch an instance, run an episode and record samples.
+    Samples are written to disk by the worker itself, so that they are never serialized
+    through the queue. For the pickle format, each sample is written to its own file, whose
+    name is sent back. For the shards format, the samples of each episode are appended to
+    the episode's own shards, whose directories are sent back at the end of the episode.
+    The same loop runs either in a thread or in a process.
     Parameters
     ----------
-    in_queue : queue.Queue
+    in_queue : queue.Queue or multiprocessing.Queue
         Input queue from which orders are received.
-    out_queue : queue.Queue
-        Output queue in which to send samples.
-    stop_flag: threading.Event
-        A flag to tell the thread to stop.
+    out_queue : queue.Queue or multiprocessing.Queue
+        Output queue in which to send (the file names of) samples.
+    stop_flag: threading.Event or multiprocessing.Event
+        A flag to tell the worker to stop.
+    server_address : str (optional)
+        Unix socket of an inference server. If given, the branching decisions of the
+        nodes where the expert is not queried are taken by the served policy, rather
+        than by pseudocosts.
+    sample_format : str in ['pickle', 'shards']
+        Whether samples are written to gzip pickle files, or to per-episode shards.
     """
+    if multiprocessing.current_process().name == 'MainProcess':
+        worker_name = threading.current_thread().name
+    else:
+        worker_name = multiprocessing.current_process().name
     sample_counter = 0
+    if server_address is not None:
+        from inference_server import InferenceClient
+        policy = InferenceClient(server_address)
     while not stop_flag.is_set():
-        episode, instance, initial_primal_bound, seed, query_expert_prob, time_limit, out_dir = in_queue.get()
-
-        observation_function = { 'scores': ExploreThenStrongBranch(expert_probability=query_expert_prob),
-                                 'node_observation': ecole.observation.NodeBipartite() }
+        # never block for good on an empty queue, so that the worker can be stopped
+        try:
+            order = in_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        episode, instance, initial_primal_bound, seed, query_expert_prob, time_limit, out_dir = order
+
+        observation_function = { 'scores': ExploreThenStrongBranch(expert_probability=query_expert_prob, seed=seed),
+                                 'node_observation': CachedNodeBipartite() }
         env = Environment(
             time_limit=time_limit,
             observation_function=observation_function,
         )
 
-        print(f"[w {threading.current_thread().name}] episode {episode}, seed {seed}, "
+        print(f"[w {worker_name}] episode {episode}, seed {seed}, "
               f"processing instance '{instance}'...\n", end='')
         out_queue.put({
             'type': 'start',
@@ -139,36 +178,51 @@ def make_samples(in_queue, out_queue, stop_flag):
             'seed': seed,
         })
 
+        if sample_format == 'shards':
+            shard_writer = ShardWriter(f'{out_dir}/episode_{episode}')
+
         env.seed(seed)
         observation, action_set, _, done, _ = env.reset(str(instance), objective_limit=initial_primal_bound)
-        while not done:
+        edges_graph, edges = None, None
+        # the episode is interrupted as soon as enough samples are collected
+        while not done and not stop_flag.is_set():
             scores, scores_are_expert = observation["scores"]
-            node_observation = observation["node_observation"]
-            node_observation = (node_observation.row_features,
-                                (node_observation.edge_features.indices,
-                                 node_observation.edge_features.values),
-                                node_observation.column_features)
+            graph, node_observation = observation["node_observation"]
 
-            action = action_set[scores[action_set].argmax()]
+            if server_address is not None and not scores_are_expert:
+                action = policy(action_set, node_observation)
+            else:
+                action = action_set[scores[action_set].argmax()]
 
             if scores_are_expert and not stop_flag.is_set():
+                # the edges are only read when the LP changes, samples of the same LP share them
+                if graph != edges_graph:
+                    edges_graph = graph
+                    edges = (node_observation.edge_features.indices, node_observation.edge_features.values)
+                node_observation = (node_observation.row_features, edges, node_observation.column_features)
+
                 data = [node_observation, action, action_set, scores]
-                filename = f'{out_dir}/sample_{episode}_{sample_counter}.pkl'
-
-                with gzip.open(filename, 'wb') as f:
-                    pickle.dump({
-                        'episode': episode,
-                        'instance': instance,
-                        'seed': seed,
-                        'data': data,
-                        }, f)
-                out_queue.put({
+                sample = {
                     'type': 'sample',
                     'episode': episode,
                     'instance': instance,
                     'seed': seed,
-                    'filename': filename,
-                })
+                }
+
+                if sample_format == 'shards':
+                    shard_writer.append(*data)
+                else:
+                    filename = f'{out_dir}/sample_{episode}_{sample_counter}.pkl'
+                    with gzip.open(filename, 'wb') as f:
+                        pickle.dump({
+                            'episode': episode,
+                            'instance': instance,
+                            'seed': seed,
+                            'data': data,
+                            }, f)
+                    sample['filename'] = filename
+
+                out_queue.put(sample)
                 sample_counter += 1
 
             try:
@@ -179,16 +233,21 @@ def make_samples(in_queue, out_queue, stop_flag):
                     f.write(f"Error occurred solving {instance} with seed {seed}\n")
                     f.write(f"{e}\n")
 
-        print(f"[w {threading.current_thread().name}] episode {episode} done, {sample_counter} samples\n", end='')
-        out_queue.put({
+        print(f"[w {worker_name}] episode {episode} done, {sample_counter} samples\n", end='')
+        done_message = {
             'type': 'done',
             'episode': episode,
             'instance': instance,
             'seed': seed,
-        })
+        }
+        if sample_format == 'shards':
+            shard_writer.close()
+            done_message['shards'] = list_shards(shard_writer.out_dir)
+        out_queue.put(done_message)
 
 
-def collect_samples(instances, out_dir, rng, n_samples, n_jobs, query_expert_prob, time_limit):
+def collect_samples(instances, out_dir, rng, n_samples, n_jobs, query_expert_prob, time_limit, backend='process',
+                    sample_format='pickle', server_address=None):
     """
     Runs branch-and-bound episodes on the given set of instances, and collects
     randomly (state, action) pairs from the 'vanilla-fullstrong' expert
@@ -210,13 +269,34 @@ def collect_samples(instances, out_dir, rng, n_samples, n_jobs, query_expert_pro
         pair.
     time_limit : float in [0, 1e+20]
         Maximum running time for an episode, in seconds.
+    backend : str in ['thread', 'process']
+        Whether sampling workers are threads or processes. Processes avoid
+        contention on the GIL when serializing samples.
+    sample_format : str in ['pickle', 'shards']
+        Whether to write one gzip pickle file per sample, or memory-mappable shards
+        (see shards.ShardWriter). Shards are written by the workers, one set per episode,
+        and moved to the output directory in episode order.
+    server_address : str (optional)
+        Unix socket of an inference server taking the non-expert branching decisions,
+        shared by all workers (pseudocosts otherwise).
+
+    Returns
+    -------
+    throughput : float
+        Number of samples collected per second.
     """
     os.makedirs(out_dir, exist_ok=True)
+    start_time = time.time()
 
     # start workers
-    orders_queue = queue.Queue(maxsize=2*n_jobs)
-    answers_queue = queue.SimpleQueue()
+    if backend == 'process':
+        orders_queue = multiprocessing.Queue(maxsize=2*n_jobs)
+        answers_queue = multiprocessing.Queue()
+    else:
+        orders_queue = queue.Queue(maxsize=2*n_jobs)
+        answers_queue = queue.SimpleQueue()
 
+    # samples are written by the workers to a temporary directory, then moved in order
     tmp_samples_dir = f'{out_dir}/tmp'
     os.makedirs(tmp_samples_dir, exist_ok=True)
 
@@ -230,15 +310,39 @@ def collect_samples(instances, out_dir, rng, n_samples, n_jobs, query_expert_pro
     dispatcher.start()
 
     workers = []
-    workers_stop_flag = threading.Event()
+    if backend == 'process':
+        workers_stop_flag = multiprocessing.Event()
+        Worker = multiprocessing.Process
+    else:
+        workers_stop_flag = threading.Event()
+        Worker = threading.Thread
     for i in range(n_jobs):
-        p = threading.Thread(
+        p = Worker(
                 target=make_samples,
-                args=(orders_queue, answers_queue, workers_stop_flag),
+                args=(orders_queue, answers_queue, workers_stop_flag, server_address, sample_format),
                 daemon=True)
         workers.append(p)
         p.start()
 
+    # shards of the finished episodes, and number of samples written from the current one
+    episode_shards = {}
+    n_shards = len(list_shards(out_dir))
+    episode_samples = 0
+
+    def move_shards(shards, n_samples=None):
+        """Moves the shards of an episode to the output directory, truncated to n_samples samples if given."""
+        nonlocal n_shards
+        for shard in shards:
+            if n_samples is not None:
+                if n_samples == 0:
+                    break
+                shard_size = len(load_shard(shard)['offsets']) - 1
+                if n_samples < shard_size:
+                    truncate_shard(shard, n_samples)
+                n_samples -= min(n_samples, shard_size)
+            os.rename(shard, f'{out_dir}/shard_{n_shards:05d}')
+            n_shards += 1
+
     # record answers and write samples
     buffer = {}
     current_episode = 0
@@ -246,6 +350,8 @@ def collect_samples(instances, out_dir, rng, n_samples, n_jobs, query_expert_pro
     in_buffer = 0
     while i < n_samples:
         sample = answers_queue.get()
+        if sample['type'] == 'done' and sample_format == 'shards':
+            episode_shards[sample['episode']] = sample['shards']
 
         # add received sample to buffer
         if sample['type'] == 'start':
@@ -264,12 +370,17 @@ def collect_samples(instances, out_dir, rng, n_samples, n_jobs, query_expert_pro
 
                 # if no more samples here, move to next episode
                 if sample['type'] == 'done':
+                    if sample_format == 'shards':
+                        move_shards(episode_shards.pop(current_episode))
                     del buffer[current_episode]
                     current_episode += 1
+                    episode_samples = 0
 
-                # else write sample
+                # else write sample (shards are moved at the end of their episode)
                 else:
-                    os.rename(sample['filename'], f'{out_dir}/sample_{i+1}.pkl')
+                    if sample_format == 'pickle':
+                        os.rename(sample['filename'], f'{out_dir}/sample_{i+1}.pkl')
+                    episode_samples += 1
                     in_buffer -= 1
                     i += 1
                     print(f"[m {threading.current_thread().name}] {i} / {n_samples} samples written, "
@@ -285,11 +396,42 @@ def collect_samples(instances, out_dir, rng, n_samples, n_jobs, query_expert_pro
                         buffer = {}
                         break
 
-    # # stop all workers
+    # stop the dispatcher and the workers, which leave their current episode at the next node
+    dispatcher_stop_flag.set()
     workers_stop_flag.set()
+    dispatcher.join()
+    def drain_answers():
+        try:
+            while True:
+                answer = answers_queue.get_nowait()
+                if answer['type'] == 'done' and sample_format == 'shards':
+                    episode_shards[answer['episode']] = answer['shards']
+        except queue.Empty:
+            pass
+
+    for p in workers:
+        # keep draining the answers, a process only exits once the ones it sent are received
+        while p.is_alive():
+            drain_answers()
+            p.join(timeout=0.1)
+    drain_answers()
+    if backend == 'process':
+        # do not wait for pending orders to be flushed to the stopped workers
+        orders_queue.cancel_join_thread()
+
+    # the last episode was interrupted, keep the samples written before the stop
+    if sample_format == 'shards' and episode_samples > 0:
+        move_shards(episode_shards[current_episode], episode_samples)
 
     shutil.rmtree(tmp_samples_dir, ignore_errors=True)
 
+    elapsed_time = time.time() - start_time
+    throughput = n_samples / elapsed_time
+    print(f"[m {threading.current_thread().name}] {n_samples} samples in {elapsed_time:.1f}s "
+          f"({throughput:.2f} samples/s, {throughput / n_jobs:.2f} samples/s per worker, {n_jobs} {backend} workers)\n", end='')
+
+    return throughput
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -311,6 +453,30 @@ if __name__ == '__main__':
         type=int,
         default=1,
     )
+    parser.add_argument(
+        '-b', '--backend',
+        help='Run parallel jobs as threads or processes.',
+        choices=['thread', 'process'],
+        default='process',
+    )
+    parser.add_argument(
+        '-f', '--format',
+        help='Write samples as memory-mappable shards, or as one gzip pickle file per sample.',
+        choices=['shards', 'pickle'],
+        default='shards',
+    )
+    parser.add_argument(
+        '-a', '--server',
+        help='Unix socket of an inference server (see inference_server.py) taking the non-expert branching decisions.',
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        '--scaling',
+        help='Only measure the throughput of 1, 2, 4, ... up to NJOBS thread and process workers, each collecting this many train samples in a temporary directory.',
+        type=int,
+        default=None,
+    )
     args = parser.parse_args()
 
     print(f"seed {args.seed}")
@@ -343,6 +509,32 @@ if __name__ == '__main__':
     print(f"{len(instances_train)} train instances for {train_size} samples")
     print(f"{len(instances_valid)} validation instances for {valid_size} samples")
 
+    if args.scaling is not None:
+        backends = ['thread', 'process']
+        n_workers = sorted({min(2**k, args.njobs) for k in range(args.njobs.bit_length() + 1)})
+        throughputs = {backend: [] for backend in backends}
+        for backend in backends:
+            for n_jobs in n_workers:
+                scaling_dir = f'{out_dir}_scaling_{backend}_{n_jobs}'
+                rng = np.random.RandomState(args.seed+100)
+                throughputs[backend].append(collect_samples(instances_train, scaling_dir, rng, args.scaling,
+                                                            n_jobs, query_expert_prob=node_record_prob,
+                                                            time_limit=time_limit, backend=backend,
+                                                            sample_format=args.format, server_address=args.server))
+                shutil.rmtree(scaling_dir, ignore_errors=True)
+
+        # speedups are relative to a single thread worker
+        print(f"{'':>8} " + " ".join(f"{backend:-^30}" for backend in backends))
+        print(f"{'workers':>8} " + " ".join(f"{'samples/s':>10} {'speedup':>8} {'efficiency':>10}" for _ in backends)
+              + f" {'process/thread':>14}")
+        for k, n_jobs in enumerate(n_workers):
+            line = f"{n_jobs:>8}"
+            for backend in backends:
+                speedup = throughputs[backend][k] / throughputs['thread'][0]
+                line += f" {throughputs[backend][k]:>10.2f} {speedup:>8.2f} {speedup / n_jobs:>10.2f}"
+            print(line + f" {throughputs['process'][k] / throughputs['thread'][k]:>14.2f}")
+        sys.exit(0)
+
     # create output directory, throws an error if it already exists
     os.makedirs(out_dir)
 
@@ -350,10 +542,12 @@ if __name__ == '__main__':
     rng = np.random.RandomState(args.seed+100)
     collect_samples(instances_train, out_dir + '/train', rng, train_size,
                     args.njobs, query_expert_prob=node_record_prob,
-                    time_limit=time_limit)
+                    time_limit=time_limit, backend=args.backend,
+                    sample_format=args.format, server_address=args.server)
 
     # generate validation samples
     rng = np.random.RandomState(args.seed + 1)
     collect_samples(instances_valid, out_dir + '/valid', rng, valid_size,
                     args.njobs, query_expert_prob=node_record_prob,
-                    time_limit=time_limit)
+                    time_limit=time_limit, backend=args.backend,
+                    sample_format=args.format, server_address=args.server)
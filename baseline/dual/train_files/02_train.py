@@ -1,14 +1,19 @@
 import os
 import sys
 import glob
+import time
 import argparse
 import pathlib
 import numpy as np
 
+from shards import list_shards
+
 
 def pretrain(policy, pretrain_loader):
     """
-    Pre-trains all PreNorm layers in the model.
+    Pre-trains all PreNorm layers in the model, in a single pass over the data. Each batch
+    goes through the layers in topological order, each layer updating its statistics and
+    normalizing its input with them before passing it on to the next ones.
 
     Parameters
     ----------
@@ -22,84 +27,17 @@ def pretrain(policy, pretrain_loader):
     i : int
         Number of pre-trained layers.
     """
-    policy.pre_train_init()
-    i = 0
-    while True:
-        for batch in pretrain_loader:
-            batch.to(device)
-            if not policy.pre_train(batch.constraint_features, batch.edge_index, batch.edge_attr, batch.variable_features):
-                break
+    policy.pre_train_init(streaming=True)
+    for batch in pretrain_loader:
+        batch = batch.to(device)
+        policy.pre_train(batch.constraint_features, batch.edge_index, batch.edge_attr, batch.variable_features)
 
-        if policy.pre_train_next() is None:
-            break
+    i = 0
+    while policy.pre_train_next() is not None:
         i += 1
     return i
 
 
-def process(policy, data_loader, top_k=[1, 3, 5, 10], optimizer=None):
-    """
-    Process samples. If an optimizer is given, also train on those samples.
-
-    Parameters
-    ----------
-    policy : torch.nn.Module
-        Model to train/evaluate.
-    data_loader : torch_geometric.data.DataLoader
-        Pre-loaded dataset of training samples.
-    top_k : list
-        Accuracy will be computed for the top k elements, for k in this list.
-    optimizer : torch.optim (optional)
-        Optimizer object. If not None, will be used for updating the model parameters.
-
-    Returns
-    -------
-    mean_loss : float in [0, 1e+20]
-        Mean cross entropy loss.
-    mean_kacc : np.ndarray
-        Mean top k accuracy, for k in the user-provided list top_k.
-    """
-    mean_loss = 0
-    mean_kacc = np.zeros(len(top_k))
-
-    n_samples_processed = 0
-    with torch.set_grad_enabled(optimizer is not None):
-        for batch in data_loader:
-            batch = batch.to(device)
-            logits = policy(batch.constraint_features, batch.edge_index, batch.edge_attr, batch.variable_features)
-            logits = pad_tensor(logits[batch.candidates], batch.nb_candidates)
-            cross_entropy_loss = F.cross_entropy(logits, batch.candidate_choices, reduction='mean')
-
-            # if an optimizer is provided, update parameters
-            if optimizer is not None:
-                optimizer.zero_grad()
-                cross_entropy_loss.backward()
-                optimizer.step()
-
-            true_scores = pad_tensor(batch.candidate_scores, batch.nb_candidates)
-            true_bestscore = true_scores.max(dim=-1, keepdims=True).values
-
-            # calculate top k accuracy
-            kacc = []
-            for k in top_k:
-                # check if there are at least k candidates
-                if logits.size()[-1] < k:
-                    kacc.append(1.0)
-                    continue
-                pred_top_k = logits.topk(k).indices
-                pred_top_k_true_scores = true_scores.gather(-1, pred_top_k)
-                accuracy = (pred_top_k_true_scores == true_bestscore).any(dim=-1).float().mean().item()
-                kacc.append(accuracy)
-            kacc = np.asarray(kacc)
-
-            mean_loss += cross_entropy_loss.item() * batch.num_graphs
-            mean_kacc += kacc * batch.num_graphs
-            n_samples_processed += batch.num_graphs
-
-    mean_loss /= n_samples_processed
-    mean_kacc /= n_samples_processed
-    return mean_loss, mean_kacc
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -119,6 +57,12 @@ if __name__ == "__main__":
         type=int,
         default=0,
     )
+    parser.add_argument(
+        '-w', '--num_workers',
+        help='Number of data loading worker processes (0 to load data in the main process).',
+        type=int,
+        default=4,
+    )
     args = parser.parse_args()
 
     # hyper parameters
@@ -128,26 +72,30 @@ if __name__ == "__main__":
     valid_batch_size = 128
     lr = 1e-3
     top_k = [1, 3, 5, 10]
+    epoch_size = int(np.floor(10000/batch_size))*batch_size
 
     # get sample directory
     if args.problem == 'item_placement':
-        train_files = glob.glob('train_files/samples/1_item_placement/train/sample_*.pkl')
-        valid_files = glob.glob('train_files/samples/1_item_placement/valid/sample_*.pkl')
+        sample_dir = 'train_files/samples/1_item_placement'
         running_dir = 'train_files/trained_models/item_placement'
 
     elif args.problem == 'load_balancing':
-        train_files = glob.glob('train_files/samples/2_load_balancing/train/sample_*.pkl')
-        valid_files = glob.glob('train_files/samples/2_load_balancing/valid/sample_*.pkl')
+        sample_dir = 'train_files/samples/2_load_balancing'
         running_dir = 'train_files/trained_models/load_balancing'
 
     elif args.problem == 'anonymous':
-        train_files = glob.glob('train_files/samples/3_anonymous/train/sample_*.pkl')
-        valid_files = glob.glob('train_files/samples/3_anonymous/valid/sample_*.pkl')
+        sample_dir = 'train_files/samples/3_anonymous'
         running_dir = 'train_files/trained_models/anonymous'
 
     else:
         raise NotImplementedError
 
+    # samples are either stored as shards, or as one pickle file per sample
+    train_shards = list_shards(f'{sample_dir}/train')
+    valid_shards = list_shards(f'{sample_dir}/valid')
+    train_files = glob.glob(f'{sample_dir}/train/sample_*.pkl')
+    valid_files = glob.glob(f'{sample_dir}/valid/sample_*.pkl')
+
     pretrain_files = [f for i, f in enumerate(train_files) if i % 10 == 0]
 
     # working directory setup
@@ -163,15 +111,15 @@ if __name__ == "__main__":
 
     # import pytorch **after** cuda setup
     import torch
-    import torch.nn.functional as F
     import torch_geometric
-    from utilities import log, pad_tensor, GraphDataset, Scheduler
+    from utilities import log, process, GraphDataset, ShardedGraphDataset, Scheduler
     sys.path.insert(0,'.')
     from model import GNNPolicy
 
     # randomization setup
-    rng = np.random.RandomState(args.seed)
     torch.manual_seed(args.seed)
+    sampler_generator = torch.Generator()
+    sampler_generator.manual_seed(args.seed)
 
     # logging setup
     logfile = os.path.join(running_dir, 'train_log.txt')
@@ -186,13 +134,29 @@ if __name__ == "__main__":
     log(f"top_k: {top_k}", logfile)
     log(f"gpu: {args.gpu}", logfile)
     log(f"seed {args.seed}", logfile)
+    log(f"num_workers: {args.num_workers}", logfile)
 
 
     # data setup
-    valid_data = GraphDataset(valid_files)
-    pretrain_data = GraphDataset(pretrain_files)
-    valid_loader = torch_geometric.data.DataLoader(valid_data, valid_batch_size, shuffle=False)
-    pretrain_loader = torch_geometric.data.DataLoader(pretrain_data, pretrain_batch_size, shuffle=False)
+    if train_shards:
+        train_data = ShardedGraphDataset(train_shards)
+        valid_data = ShardedGraphDataset(valid_shards)
+        pretrain_data = ShardedGraphDataset(train_shards, indices=np.arange(0, len(train_data), 10))
+    else:
+        train_data = GraphDataset(train_files)
+        valid_data = GraphDataset(valid_files)
+        pretrain_data = GraphDataset(pretrain_files)
+
+    # worker processes decode samples in the background, and are kept alive across epochs
+    loader_kwargs = {'num_workers': args.num_workers, 'pin_memory': device != "cpu"}
+    if args.num_workers > 0:
+        loader_kwargs.update({'persistent_workers': True, 'prefetch_factor': 4})
+
+    # each epoch draws a new random subset of the training samples (with replacement)
+    train_sampler = torch.utils.data.RandomSampler(train_data, replacement=True, num_samples=epoch_size, generator=sampler_generator)
+    train_loader = torch_geometric.data.DataLoader(train_data, batch_size, sampler=train_sampler, **loader_kwargs)
+    valid_loader = torch_geometric.data.DataLoader(valid_data, valid_batch_size, shuffle=False, **loader_kwargs)
+    pretrain_loader = torch_geometric.data.DataLoader(pretrain_data, pretrain_batch_size, shuffle=False, **loader_kwargs)
 
 
     policy = GNNPolicy().to(device)
@@ -205,15 +169,18 @@ if __name__ == "__main__":
             n = pretrain(policy, pretrain_loader)
             log(f"PRETRAINED {n} LAYERS", logfile)
         else:
-            epoch_train_files = rng.choice(train_files, int(np.floor(10000/batch_size))*batch_size, replace=True)
-            train_data = GraphDataset(epoch_train_files)
-            train_loader = torch_geometric.data.DataLoader(train_data, batch_size, shuffle=True)
-            train_loss, train_kacc = process(policy, train_loader, top_k, optimizer)
-            log(f"TRAIN LOSS: {train_loss:0.3f} " + "".join([f" acc@{k}: {acc:0.3f}" for k, acc in zip(top_k, train_kacc)]), logfile)
+            start_time = time.time()
+            train_loss, train_kacc = process(policy, train_loader, device, top_k, optimizer)
+            train_speed = epoch_size / (time.time() - start_time)
+            log(f"TRAIN LOSS: {train_loss:0.3f} " + "".join([f" acc@{k}: {acc:0.3f}" for k, acc in zip(top_k, train_kacc)])
+                + f" ({train_speed:0.1f} samples/s)", logfile)
 
         # validate
-        valid_loss, valid_kacc = process(policy, valid_loader, top_k, None)
-        log(f"VALID LOSS: {valid_loss:0.3f} " + "".join([f" acc@{k}: {acc:0.3f}" for k, acc in zip(top_k, valid_kacc)]), logfile)
+        start_time = time.time()
+        valid_loss, valid_kacc = process(policy, valid_loader, device, top_k, None)
+        valid_speed = len(valid_data) / (time.time() - start_time)
+        log(f"VALID LOSS: {valid_loss:0.3f} " + "".join([f" acc@{k}: {acc:0.3f}" for k, acc in zip(top_k, valid_kacc)])
+            + f" ({valid_speed:0.1f} samples/s)", logfile)
 
         scheduler.step(valid_loss)
         if scheduler.num_bad_epochs == 0:
@@ -227,5 +194,5 @@ if __name__ == "__main__":
 
     # load best parameters and run a final validation step
     policy.load_state_dict(torch.load(pathlib.Path(running_dir)/'best_params.pkl'))
-    valid_loss, valid_kacc = process(policy, valid_loader, top_k, None)
+    valid_loss, valid_kacc = process(policy, valid_loader, device, top_k, None)
     log(f"BEST VALID LOSS: {valid_loss:0.3f} " + "".join([f" acc@{k}: {acc:0.3f}" for k, acc in zip(top_k, valid_kacc)]), logfile)
@@ -0,0 +1,180 @@
+import os
+import sys
+import csv
+import glob
+import time
+import argparse
+import pathlib
+import numpy as np
+
+from shards import list_shards
+
+
+def forward_latencies(policy, inputs, device, n_warmup=5):
+    """
+    Times the policy's forward pass alone on each input, after a few warm-up passes
+    (e.g. TorchScript's compilation on the first calls).
+
+    Parameters
+    ----------
+    policy : torch.nn.Module
+        Inference model.
+    inputs : list
+        (constraint_features, edge_indices, edge_features, variable_features, candidates)
+        of each sample, on the device of the model.
+    device : str
+        Device of the model.
+    n_warmup : int
+        Number of untimed forward passes, on the first inputs.
+
+    Returns
+    -------
+    latencies : np.ndarray
+        Latency of each forward pass, in milliseconds.
+    """
+    latencies = []
+    with torch.no_grad():
+        for i in range(n_warmup + len(inputs)):
+            sample_inputs = inputs[i % len(inputs)] if i < n_warmup else inputs[i - n_warmup]
+            if device != "cpu":
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            policy(*sample_inputs)
+            if device != "cpu":
+                torch.cuda.synchronize()
+            if i >= n_warmup:
+                latencies.append((time.perf_counter() - start) * 1000)
+    return np.asarray(latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'problem',
+        help='MILP instance type to process.',
+        choices=['item_placement', 'load_balancing', 'anonymous'],
+    )
+    parser.add_argument(
+        '-g', '--gpu',
+        help='CUDA GPU id (-1 for CPU).',
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        '-t', '--tolerance',
+        help='Maximum acc@1 drop of an accepted variant, relative to the original policy.',
+        type=float,
+        default=0.01,
+    )
+    parser.add_argument(
+        '-n', '--nsamples',
+        help='Number of validation samples in the report (all by default).',
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        '-l', '--nlatency',
+        help='Number of validation samples whose forward pass is timed, one at a time.',
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        '-w', '--num_workers',
+        help='Number of data loading worker processes (0 to load data in the main process).',
+        type=int,
+        default=4,
+    )
+    args = parser.parse_args()
+
+    top_k = [1, 3, 5, 10]
+    valid_batch_size = 128
+
+    # get sample directory
+    if args.problem == 'item_placement':
+        sample_dir = 'train_files/samples/1_item_placement'
+        running_dir = 'train_files/trained_models/item_placement'
+
+    elif args.problem == 'load_balancing':
+        sample_dir = 'train_files/samples/2_load_balancing'
+        running_dir = 'train_files/trained_models/load_balancing'
+
+    elif args.problem == 'anonymous':
+        sample_dir = 'train_files/samples/3_anonymous'
+        running_dir = 'train_files/trained_models/anonymous'
+
+    else:
+        raise NotImplementedError
+
+    valid_shards = list_shards(f'{sample_dir}/valid')
+    valid_files = glob.glob(f'{sample_dir}/valid/sample_*.pkl')
+
+    # cuda setup
+    if args.gpu == -1:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+        device = "cpu"
+    else:
+        os.environ['CUDA_VISIBLE_DEVICES'] = f'{args.gpu}'
+        device = f"cuda:0"
+
+    # import pytorch **after** cuda setup
+    import torch
+    import torch_geometric
+    from utilities import log, process, GraphDataset, ShardedGraphDataset
+    sys.path.insert(0,'.')
+    from model import GNNPolicy, POLICY_VARIANTS, params_file, convert_policy, load_policy
+
+    logfile = os.path.join(running_dir, 'export_log.txt')
+
+    if valid_shards:
+        valid_data = ShardedGraphDataset(valid_shards)
+        if args.nsamples is not None:
+            valid_data = ShardedGraphDataset(valid_shards, indices=np.arange(min(args.nsamples, len(valid_data))))
+    else:
+        valid_data = GraphDataset(sorted(valid_files)[:args.nsamples])
+    loader_kwargs = {'num_workers': args.num_workers, 'pin_memory': device != "cpu"}
+    if args.num_workers > 0:
+        loader_kwargs.update({'persistent_workers': True, 'prefetch_factor': 4})
+    valid_loader = torch_geometric.data.DataLoader(valid_data, valid_batch_size, shuffle=False, **loader_kwargs)
+
+    # inputs of single branching decisions, loaded once, whose forward pass alone is timed
+    latency_inputs = []
+    for i in range(min(args.nlatency, len(valid_data))):
+        sample = valid_data[i]
+        latency_inputs.append((sample.constraint_features, sample.edge_index, sample.edge_attr,
+                               sample.variable_features, sample.candidates))
+
+    log(f"Exporting {params_file(running_dir)}, accuracy on {len(valid_data)} validation samples, "
+        f"latency on {len(latency_inputs)}", logfile)
+
+    rows = []
+    for variant in POLICY_VARIANTS:
+        if variant != 'fp32':
+            policy = GNNPolicy()
+            policy.load_state_dict(torch.load(params_file(running_dir), map_location="cpu"))
+            torch.save(convert_policy(policy, variant).state_dict(), params_file(running_dir, variant))
+
+        # the variants are evaluated as loaded by the agent
+        variant_device = "cpu" if variant == 'int8' else device
+        policy = load_policy(running_dir, variant, variant_device)
+
+        valid_loss, valid_kacc = process(policy, valid_loader, variant_device, top_k, None)
+        inputs = [tuple(x.to(variant_device) for x in sample_inputs) for sample_inputs in latency_inputs]
+        latency = forward_latencies(policy, inputs, variant_device).mean()
+
+        # only keep the variants that are as accurate as the original policy, up to the tolerance
+        accepted = variant == 'fp32' or valid_kacc[0] >= rows[0]['acc@1'] - args.tolerance
+        if not accepted:
+            os.remove(params_file(running_dir, variant))
+
+        rows.append({'variant': variant, 'device': variant_device, 'loss': valid_loss,
+                     **{f'acc@{k}': acc for k, acc in zip(top_k, valid_kacc)},
+                     'latency_ms': latency, 'accepted': accepted})
+        log(f"{variant:>4} ({variant_device}) LOSS: {valid_loss:0.3f} " + "".join([f" acc@{k}: {acc:0.3f}" for k, acc in zip(top_k, valid_kacc)])
+            + f" ({latency:0.2f} ms/decision) " + ("accepted" if accepted else "REJECTED"), logfile)
+
+    report_file = pathlib.Path(running_dir)/'export_report.csv'
+    with open(report_file, mode='w') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=rows[0].keys())
+        writer.writeheader()
+        writer.writerows(rows)
+    log(f"Report saved to {report_file}", logfile)
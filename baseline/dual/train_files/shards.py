@@ -0,0 +1,221 @@
+import os
+import glob
+import gzip
+import pickle
+import shutil
+import argparse
+import numpy as np
+
+
+# variable features holding incumbent information, masked from the policy's inputs
+INCUMBENT_FEATURES = [13, 14]
+
+# arrays stored in each shard, along with their data type
+SHARD_ARRAYS = {
+    'constraint_features': np.float32,  # (n_rows, n_row_features)
+    'variable_features': np.float32,    # (n_cols, n_col_features), without incumbent features
+    'edge_indices': np.int64,           # (2, n_edges), relative to the sample
+    'edge_features': np.float32,        # (n_edges,)
+    'candidates': np.int64,             # (n_candidates,), relative to the sample
+    'candidate_scores': np.float32,     # (n_candidates,)
+    'candidate_choices': np.int64,      # (n_samples,), relative to the candidates
+    'offsets': np.int64,                # (n_samples+1, 4), start of each sample's rows, cols, edges and candidates
+}
+
+
+class ShardWriter:
+    """
+    Writes samples to an append-only store of shards. Each shard is a directory holding
+    the concatenated rows, columns, edges and candidates of its samples as .npy files,
+    along with an index of per-sample offsets, so that it can be read through memory maps.
+    Incumbent features are masked once here, so that samples can be served as is.
+
+    Parameters
+    ----------
+    out_dir : str
+        Directory in which to write the shards. Shards already present are kept.
+    shard_size : int
+        Number of samples per shard.
+    """
+    def __init__(self, out_dir, shard_size=1000):
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.n_shards = len(glob.glob(f'{out_dir}/shard_*'))
+        self.samples = []
+
+    def append(self, node_observation, action, action_set, scores):
+        """
+        Adds a sample to the current shard, and writes it if full.
+
+        Parameters
+        ----------
+        node_observation : tuple
+            (constraint_features, (edge_indices, edge_features), variable_features)
+        action : int
+            Chosen variable.
+        action_set : np.ndarray
+            Candidate variables.
+        scores : np.ndarray
+            Expert scores of all variables.
+        """
+        self.samples.append((node_observation, action, action_set, scores))
+        if len(self.samples) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the current shard, if not empty.
+        """
+        if not self.samples:
+            return
+
+        arrays = {key: [] for key in SHARD_ARRAYS if key != 'offsets'}
+        sizes = []
+        for (constraint_features, (edge_indices, edge_features), variable_features), action, action_set, scores in self.samples:
+            candidates = np.asarray(action_set, dtype=np.int64)
+            arrays['constraint_features'].append(constraint_features)
+            arrays['variable_features'].append(np.delete(variable_features, INCUMBENT_FEATURES, axis=1))
+            arrays['edge_indices'].append(edge_indices)
+            arrays['edge_features'].append(edge_features)
+            arrays['candidates'].append(candidates)
+            arrays['candidate_scores'].append(np.asarray(scores)[candidates])
+            arrays['candidate_choices'].append([np.flatnonzero(candidates == action)[0]])
+            sizes.append((len(constraint_features), len(variable_features), edge_indices.shape[1], len(candidates)))
+
+        offsets = np.zeros((len(sizes)+1, 4), dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes, axis=0)
+
+        # write to a temporary directory first, so that readers never see partial shards
+        shard_dir = f'{self.out_dir}/shard_{self.n_shards:05d}'
+        tmp_dir = f'{self.out_dir}/tmp_shard_{self.n_shards:05d}'
+        os.makedirs(tmp_dir, exist_ok=True)
+        for key, values in arrays.items():
+            values = np.concatenate(values, axis=1 if key == 'edge_indices' else 0)
+            np.save(f'{tmp_dir}/{key}.npy', values.astype(SHARD_ARRAYS[key], copy=False))
+        np.save(f'{tmp_dir}/offsets.npy', offsets)
+        os.rename(tmp_dir, shard_dir)
+
+        self.n_shards += 1
+        self.samples = []
+
+    def close(self):
+        self.flush()
+
+
+def load_shard(shard_dir):
+    """
+    Memory-maps the arrays of a shard.
+
+    Parameters
+    ----------
+    shard_dir : str
+        Shard directory.
+
+    Returns
+    -------
+    shard : dict
+        Arrays of the shard. Those are copy-on-write memory maps, so that tensors can
+        be built on top of them without copying nor modifying the files.
+    """
+    return {key: np.load(f'{shard_dir}/{key}.npy', mmap_mode='c') for key in SHARD_ARRAYS}
+
+
+def list_shards(sample_dir):
+    """
+    Lists the complete shards in a sample directory.
+    """
+    return sorted(glob.glob(f'{sample_dir}/shard_*'))
+
+
+def truncate_shard(shard_dir, n_samples):
+    """
+    Keeps only the first samples of a shard, which is rewritten in place.
+
+    Parameters
+    ----------
+    shard_dir : str
+        Shard directory.
+    n_samples : int
+        Number of samples to keep, at most the number of samples of the shard.
+    """
+    shard = load_shard(shard_dir)
+    offsets = np.array(shard['offsets'][:n_samples+1])
+    n_rows, n_cols, n_edges, n_candidates = offsets[-1]
+    ends = {
+        'constraint_features': n_rows,
+        'variable_features': n_cols,
+        'edge_indices': n_edges,
+        'edge_features': n_edges,
+        'candidates': n_candidates,
+        'candidate_scores': n_candidates,
+        'candidate_choices': n_samples,
+    }
+
+    # arrays are copied before the memory maps are released, then replaced all at once
+    tmp_dir = os.path.join(os.path.dirname(shard_dir), f'tmp_{os.path.basename(shard_dir)}')
+    os.makedirs(tmp_dir, exist_ok=True)
+    for key, end in ends.items():
+        values = shard[key][:, :end] if key == 'edge_indices' else shard[key][:end]
+        np.save(f'{tmp_dir}/{key}.npy', np.array(values))
+    np.save(f'{tmp_dir}/offsets.npy', offsets)
+    del shard
+    shutil.rmtree(shard_dir)
+    os.rename(tmp_dir, shard_dir)
+
+
+def convert_samples(sample_dir, shard_size=1000, remove=False):
+    """
+    Converts the gzip pickle sample files of a directory into shards, in that same directory.
+
+    Parameters
+    ----------
+    sample_dir : str
+        Directory containing the sample_*.pkl files.
+    shard_size : int
+        Number of samples per shard.
+    remove : bool
+        Whether to remove the sample files once converted.
+    """
+    sample_files = glob.glob(f'{sample_dir}/sample_*.pkl')
+    sample_files.sort(key=lambda f: int(os.path.basename(f)[len('sample_'):-len('.pkl')]))
+
+    writer = ShardWriter(sample_dir, shard_size)
+    for sample_file in sample_files:
+        with gzip.open(sample_file, 'rb') as f:
+            writer.append(*pickle.load(f)['data'])
+    writer.close()
+
+    if remove:
+        for sample_file in sample_files:
+            os.remove(sample_file)
+
+    return len(sample_files)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'problem',
+        help='MILP instance type to process.',
+        choices=['item_placement', 'load_balancing', 'anonymous'],
+    )
+    parser.add_argument(
+        '--remove',
+        help='Remove the pickle sample files once converted.',
+        action='store_true',
+    )
+    args = parser.parse_args()
+
+    if args.problem == 'item_placement':
+        sample_dir = 'train_files/samples/1_item_placement'
+    elif args.problem == 'load_balancing':
+        sample_dir = 'train_files/samples/2_load_balancing'
+    elif args.problem == 'anonymous':
+        sample_dir = 'train_files/samples/3_anonymous'
+
+    for folder in ['train', 'valid']:
+        if list_shards(f'{sample_dir}/{folder}'):
+            print(f"{sample_dir}/{folder} already contains shards, skipping")
+            continue
+        n_samples = convert_samples(f'{sample_dir}/{folder}', remove=args.remove)
+        print(f"{n_samples} samples converted to shards in {sample_dir}/{folder}")
@@ -7,6 +7,8 @@ import torch
 import torch.nn.functional as F
 import torch_geometric
 
+from shards import load_shard, INCUMBENT_FEATURES
+
 def log(str, logfile=None):
     """
     Prints the provided string, and also logs it if a logfile is passed.
@@ -29,6 +31,8 @@ def pad_tensor(input_, pad_sizes, pad_value=-1e8):
     """
     Takes a 1D tensor, splits it into slices according to pad_sizes, and pads each
     slice  with pad_value to obtain a 2D tensor of size (pad_sizes.shape[0], pad_sizes.max()).
+    All slices are written at once with a single scatter. The scatter indices are computed
+    on the device of pad_sizes, which can be kept on the host to avoid synchronizations.
 
     Parameters
     ----------
@@ -44,13 +48,101 @@ def pad_tensor(input_, pad_sizes, pad_value=-1e8):
     output : 2D torch.Tensor
         Tensor resulting from the slicing + padding operations.
     """
-    max_pad_size = pad_sizes.max()
-    output = input_.split(pad_sizes.cpu().numpy().tolist())
-    output = torch.stack([F.pad(slice_, (0, max_pad_size-slice_.size(0)), 'constant', pad_value)
-                          for slice_ in output], dim=0)
+    max_pad_size = int(pad_sizes.max())
+    slice_starts = pad_sizes.cumsum(0) - pad_sizes
+    slice_indices = torch.repeat_interleave(torch.arange(len(pad_sizes), device=pad_sizes.device), pad_sizes)
+    positions = torch.arange(len(slice_indices), device=pad_sizes.device) - slice_starts[slice_indices]
+
+    output = input_.new_full((len(pad_sizes), max_pad_size), pad_value)
+    output = output.index_put((slice_indices.to(input_.device), positions.to(input_.device)), input_)
     return output
 
 
+def top_k_hits(logits, true_scores, top_k):
+    """
+    Counts the samples for which a best scoring candidate is among the k candidates with
+    the highest logits, for every k at once: a single topk for the largest k, followed
+    by a cumulative any over the ranks. Counts stay on the device of the inputs, so
+    that they can be accumulated without synchronizing with the host at each batch.
+
+    Parameters
+    ----------
+    logits : 2D torch.Tensor
+        Padded logits of the candidates, of size (n_samples, max_candidates).
+    true_scores : 2D torch.Tensor
+        Padded expert scores of the candidates, of same size.
+    top_k : list
+        Values of k. Samples with at most k candidates are always counted.
+
+    Returns
+    -------
+    hits : 1D torch.Tensor
+        Number of hits, for k in top_k.
+    """
+    max_k = min(max(top_k), logits.shape[-1])
+    true_bestscore = true_scores.max(dim=-1, keepdim=True).values
+    pred_top_k = logits.topk(max_k).indices
+    hits = (true_scores.gather(-1, pred_top_k) == true_bestscore).cumsum(dim=-1) > 0
+    ranks = torch.tensor([min(k, max_k) - 1 for k in top_k], device=logits.device)
+    return hits.index_select(-1, ranks).sum(dim=0)
+
+
+def process(policy, data_loader, device, top_k=[1, 3, 5, 10], optimizer=None):
+    """
+    Process samples. If an optimizer is given, also train on those samples.
+
+    Parameters
+    ----------
+    policy : torch.nn.Module
+        Model to train/evaluate.
+    data_loader : torch_geometric.data.DataLoader
+        Pre-loaded dataset of training samples.
+    device : str
+        Device of the model.
+    top_k : list
+        Accuracy will be computed for the top k elements, for k in this list.
+    optimizer : torch.optim (optional)
+        Optimizer object. If not None, will be used for updating the model parameters.
+
+    Returns
+    -------
+    mean_loss : float in [0, 1e+20]
+        Mean cross entropy loss.
+    mean_kacc : np.ndarray
+        Mean top k accuracy, for k in the user-provided list top_k.
+    """
+    # metrics are accumulated on the device, and only synchronized with the host at the end
+    mean_loss = torch.zeros((), device=device)
+    mean_kacc = torch.zeros(len(top_k), device=device)
+
+    n_samples_processed = 0
+    with torch.set_grad_enabled(optimizer is not None):
+        for batch in data_loader:
+            nb_candidates = batch.nb_candidates  # kept on the host for padding
+            batch = batch.to(device)
+            logits = policy(batch.constraint_features, batch.edge_index, batch.edge_attr, batch.variable_features, batch.candidates)
+            logits = pad_tensor(logits, nb_candidates)
+            cross_entropy_loss = F.cross_entropy(logits, batch.candidate_choices, reduction='mean')
+
+            # if an optimizer is provided, update parameters
+            if optimizer is not None:
+                optimizer.zero_grad()
+                cross_entropy_loss.backward()
+                optimizer.step()
+
+            # calculate top k accuracy
+            true_scores = pad_tensor(batch.candidate_scores, nb_candidates)
+            kacc = top_k_hits(logits.detach(), true_scores, top_k)
+
+            mean_loss += cross_entropy_loss.detach() * batch.num_graphs
+            mean_kacc += kacc
+            n_samples_processed += batch.num_graphs
+
+    mean_loss = mean_loss.item() / n_samples_processed
+    mean_kacc = mean_kacc.cpu().numpy() / n_samples_processed
+    return mean_loss, mean_kacc
+
+
 class BipartiteNodeData(torch_geometric.data.Data):
     """
     Data class modelling a single graph.
@@ -98,6 +190,7 @@ class GraphDataset(torch_geometric.data.Dataset):
     def __init__(self, sample_files):
         super().__init__(root=None, transform=None, pre_transform=None)
         self.sample_files = sample_files
+        self.variable_feature_mask = None
 
     def len(self):
         """
@@ -126,18 +219,95 @@ class GraphDataset(torch_geometric.data.Dataset):
 
         constraint_features, (edge_indices, edge_features), variable_features = sample_observation
 
-        # mask variable features (no incumbent info)
-        variable_features = np.delete(variable_features, 14, axis=1)
-        variable_features = np.delete(variable_features, 13, axis=1)
+        # mask variable features (no incumbent info), in a single gather
+        if self.variable_feature_mask is None:
+            self.variable_feature_mask = np.delete(np.arange(variable_features.shape[1]), INCUMBENT_FEATURES)
+        variable_features = variable_features[:, self.variable_feature_mask]
+
+        constraint_features = torch.from_numpy(constraint_features.astype(np.float32, copy=False))
+        edge_indices = torch.from_numpy(edge_indices.astype(np.int64))
+        edge_features = torch.from_numpy(edge_features.astype(np.float32, copy=False)).unsqueeze(-1)
+        variable_features = torch.from_numpy(variable_features.astype(np.float32, copy=False))
+
+        candidates = np.asarray(sample_action_set, dtype=np.int64)
+        candidate_choice = torch.as_tensor(np.flatnonzero(candidates == sample_action)[0])  # action index relative to candidates
+        candidate_scores = torch.from_numpy(np.asarray(sample_scores, dtype=np.float32)[candidates])
+        candidates = torch.from_numpy(candidates)
+
+        graph = BipartiteNodeData(constraint_features, edge_indices, edge_features, variable_features,
+                                  candidates, candidate_choice, candidate_scores)
+        graph.num_nodes = constraint_features.shape[0]+variable_features.shape[0]
+        return graph
+
+
+class ShardedGraphDataset(torch_geometric.data.Dataset):
+    """
+    Dataset class reading samples from memory-mapped shards (see shards.ShardWriter).
+
+    Parameters
+    ----------
+    shard_dirs : list
+        List containing the path to the shard directories.
+    indices : list (optional)
+        Global indices of the samples to serve, possibly with repetitions. All the
+        samples of the shards by default.
+    """
+    def __init__(self, shard_dirs, indices=None):
+        super().__init__(root=None, transform=None, pre_transform=None)
+        self.shard_dirs = shard_dirs
+        self.shards = [None] * len(shard_dirs)
+
+        # global sample index -> (shard, position in shard)
+        shard_sizes = [len(np.load(f'{shard_dir}/candidate_choices.npy', mmap_mode='r')) for shard_dir in shard_dirs]
+        self.sample_shards = np.repeat(np.arange(len(shard_dirs)), shard_sizes)
+        self.sample_positions = np.concatenate([np.arange(size) for size in shard_sizes]) if shard_dirs else np.zeros(0, dtype=np.int64)
+        self.sample_indices = np.arange(len(self.sample_shards)) if indices is None else np.asarray(indices)
+
+    def num_samples(self):
+        """
+        Returns the total number of samples in the shards, regardless of indices.
+        """
+        return len(self.sample_shards)
+
+    def len(self):
+        """
+        Returns the number of samples in the dataset
+        """
+        return len(self.sample_indices)
+
+    def get(self, index):
+        """
+        Reads and returns sample at position <index> of the dataset.
+
+        Parameters
+        ----------
+        index : int
+            Index over the sample indices. Will return sample in this position.
+
+        Returns
+        -------
+        graph : BipartiteNodeData object
+            Data sample, in this case a  bipartite graph.
+        """
+        sample_index = self.sample_indices[index]
+        shard_index, i = self.sample_shards[sample_index], self.sample_positions[sample_index]
+
+        # shards are mapped lazily, so that each data loader worker maps its own
+        if self.shards[shard_index] is None:
+            self.shards[shard_index] = load_shard(self.shard_dirs[shard_index])
+        shard = self.shards[shard_index]
+
+        (r0, c0, e0, k0), (r1, c1, e1, k1) = shard['offsets'][i], shard['offsets'][i+1]
 
-        constraint_features = torch.FloatTensor(constraint_features)
-        edge_indices = torch.LongTensor(edge_indices.astype(np.int32))
-        edge_features = torch.FloatTensor(np.expand_dims(edge_features, axis=-1))
-        variable_features = torch.FloatTensor(variable_features)
+        # variable features are already masked (no incumbent info)
+        constraint_features = torch.from_numpy(shard['constraint_features'][r0:r1])
+        edge_indices = torch.from_numpy(shard['edge_indices'][:, e0:e1])
+        edge_features = torch.from_numpy(shard['edge_features'][e0:e1]).unsqueeze(-1)
+        variable_features = torch.from_numpy(shard['variable_features'][c0:c1])
 
-        candidates = torch.LongTensor(np.array(sample_action_set, dtype=np.int32))
-        candidate_choice = torch.where(candidates == sample_action)[0][0]  # action index relative to candidates
-        candidate_scores = torch.FloatTensor([sample_scores[j] for j in candidates])
+        candidates = torch.from_numpy(shard['candidates'][k0:k1])
+        candidate_choice = torch.as_tensor(shard['candidate_choices'][i])
+        candidate_scores = torch.from_numpy(shard['candidate_scores'][k0:k1])
 
         graph = BipartiteNodeData(constraint_features, edge_indices, edge_features, variable_features,
                                   candidates, candidate_choice, candidate_scores)
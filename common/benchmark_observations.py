@@ -0,0 +1,174 @@
+import argparse
+import json
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+
+class ReferencePrimalObservation():
+    """Observation function of the original example primal agent, one Python call per variable and bound."""
+
+    def seed(self, seed):
+        pass
+
+    def before_reset(self, model):
+        pass
+
+    def extract(self, model, done):
+        if done:
+            return None
+
+        m = model.as_pyscipopt()
+        variables = m.getVars(transformed=True)
+        inf = m.infinity()
+
+        lbs = np.asarray([v.getLbLocal() for v in variables])
+        ubs = np.asarray([v.getUbLocal() for v in variables])
+        has_lb = np.asarray([lb > -inf for lb in lbs])
+        has_ub = np.asarray([ub < inf for ub in ubs])
+
+        return (has_lb, has_ub, lbs, ubs)
+
+
+class ReferenceDualObservation():
+    """
+    Observation function of the original example dual agent, three Python calls per LP column.
+    Its arrays are indexed by LP column position rather than by variable, so they only match
+    the ones of the current example agent when both orders coincide.
+    """
+
+    def seed(self, seed):
+        pass
+
+    def before_reset(self, model):
+        pass
+
+    def extract(self, model, done):
+        if done:
+            return None
+
+        m = model.as_pyscipopt()
+        lp_columns = m.getLPColsData()
+        lp_variables = [col.getVar() for col in lp_columns]
+
+        lp_var_lpsols = np.asarray([var.getLPSol() for var in lp_variables])
+        lp_var_objs = np.asarray([var.getObj() for var in lp_variables])
+
+        return (lp_var_lpsols, lp_var_objs)
+
+
+REFERENCE_FUNCTIONS = {
+    'primal': ReferencePrimalObservation,
+    'dual': ReferenceDualObservation,
+}
+
+
+class ComparedObservations():
+    """
+    Runs a reference and a candidate observation function at each step, records the wall time
+    of both extractions and whether they agree, and returns the candidate observation.
+    """
+
+    def __init__(self, reference, candidate):
+        self.reference = reference
+        self.candidate = candidate
+        self.times = {'reference': [], 'candidate': []}
+        self.mismatches = 0
+
+    def seed(self, seed):
+        self.reference.seed(seed)
+        self.candidate.seed(seed)
+
+    def before_reset(self, model):
+        self.reference.before_reset(model)
+        self.candidate.before_reset(model)
+
+    def extract(self, model, done):
+        start = time.perf_counter()
+        reference = self.reference.extract(model, done)
+        self.times['reference'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        candidate = self.candidate.extract(model, done)
+        self.times['candidate'].append(time.perf_counter() - start)
+
+        if reference is not None and not all(np.array_equal(a, b) for a, b in zip(reference, candidate)):
+            self.mismatches += 1
+
+        return candidate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'task',
+        help='Task whose observation function to benchmark.',
+        choices=list(REFERENCE_FUNCTIONS),
+    )
+    parser.add_argument(
+        'problem',
+        help='Problem benchmark to process.',
+        choices=['item_placement', 'load_balancing', 'anonymous'],
+    )
+    parser.add_argument(
+        '-i', '--instance',
+        help='Index of the instance in the validation folder.',
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        '-n', '--nsteps',
+        help='Maximum number of steps.',
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        '-t', '--timelimit',
+        help='Episode time limit (in seconds).',
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        '-s', '--seed',
+        help='Episode seed.',
+        type=int,
+        default=0,
+    )
+    args = parser.parse_args()
+
+    # submission's agents are imported from the current directory, as in evaluate.py
+    sys.path.insert(0, str(pathlib.Path(__file__).parent.resolve()))
+    sys.path.insert(1, str(pathlib.Path.cwd()))
+    from evaluate import setup_task
+
+    Policy, ObservationFunction, Environment, _, _, _ = setup_task(args.task)
+
+    problem_dir = {'item_placement': '1_item_placement', 'load_balancing': '2_load_balancing', 'anonymous': '3_anonymous'}[args.problem]
+    instance = sorted(pathlib.Path(f"../../instances/{problem_dir}/valid/").glob('*.mps.gz'))[args.instance]
+
+    observation_function = ComparedObservations(REFERENCE_FUNCTIONS[args.task](), ObservationFunction(problem=args.problem))
+    policy = Policy(problem=args.problem)
+    env = Environment(time_limit=args.timelimit, observation_function=observation_function)
+
+    observation_function.seed(args.seed)
+    policy.seed(args.seed)
+    env.seed(args.seed)
+
+    with open(instance.with_name(instance.stem).with_suffix('.json')) as f:
+        instance_info = json.load(f)
+
+    observation, action_set, _, done, _ = env.reset(str(instance), objective_limit=instance_info["primal_bound"])
+    n_steps = 0
+    while not done and n_steps < args.nsteps:
+        observation, action_set, _, done, _ = env.step(policy(action_set, observation))
+        n_steps += 1
+
+    print(f"{args.task} observation extraction on {instance.name}, {len(observation_function.times['candidate'])} extractions")
+    print(f"  {'':10} {'mean (ms)':>10} {'p50 (ms)':>10} {'p90 (ms)':>10}")
+    for name, times in observation_function.times.items():
+        times = np.asarray(times) * 1000
+        print(f"  {name:10} {times.mean():10.3f} {np.percentile(times, 50):10.3f} {np.percentile(times, 90):10.3f}")
+    speedup = np.sum(observation_function.times['reference']) / np.sum(observation_function.times['candidate'])
+    print(f"  speedup: {speedup:.1f}x, {observation_function.mismatches} mismatching observations")
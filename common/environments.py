@@ -1,6 +1,158 @@
+import collections
+import numbers
+import os
+
 import ecole
+import numpy as np
 import pyscipopt
 
+# imported as common.environments (from the repository root) or as environments (from common/)
+try:
+    from .scip_parameters import ParameterCatalogue
+except ImportError:
+    from scip_parameters import ParameterCatalogue
+
+
+class InstanceCache():
+    """
+    LRU cache of parsed instances, keyed by path and modification time, so that
+    each instance file is read and parsed only once per process. Cached models are
+    never handed out directly, only copies of their original problem.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum total size of the cached instances, estimated from the size of their
+        (uncompressed) instance files, in bytes. The most recent instance is always kept.
+    """
+
+    def __init__(self, max_size=2**30):
+        self.max_size = max_size
+        self.models = collections.OrderedDict()
+        self.size = 0
+
+    @staticmethod
+    def instance_size(path):
+        if path.endswith('.gz'):
+            # the gzip trailer stores the uncompressed size (modulo 2^32)
+            with open(path, 'rb') as f:
+                f.seek(-4, os.SEEK_END)
+                return int.from_bytes(f.read(4), 'little')
+        return os.path.getsize(path)
+
+    def get(self, instance):
+        path = os.path.realpath(instance)
+        key = (path, os.stat(path).st_mtime_ns)
+
+        if key in self.models:
+            self.models.move_to_end(key)
+        else:
+            # discard outdated versions of the same file
+            for old_key in [k for k in self.models if k[0] == path]:
+                self.size -= self.models.pop(old_key)[1]
+
+            model = ecole.core.scip.Model.from_file(path)
+            size = self.instance_size(path)
+            self.models[key] = (model, size)
+            self.size += size
+
+            while self.size > self.max_size and len(self.models) > 1:
+                self.size -= self.models.popitem(last=False)[1][1]
+
+        return self.models[key][0].copy_orig()
+
+    def clear(self):
+        self.models.clear()
+        self.size = 0
+
+
+# shared by all environments in the process
+instance_cache = InstanceCache()
+
+
+# parameters that would change the evaluation conditions
+FORBIDDEN_PARAMS = frozenset([
+    "limits/time",
+    "timing/clocktype",
+    "timing/enabled",
+    "timing/reading",
+    "timing/rareclockcheck",
+    "timing/statistictiming",
+    "limits/memory"])
+
+
+class ParameterValidator():
+    """
+    Checks SCIP parameter settings (actions of the configuring task) before any solver work.
+    The index of parameter types and ranges is built once per process, on first use, from
+    the parameter catalogue and SCIP's own parameter table, which also holds the parameters
+    missing from the catalogue (those are only checked for their name and type).
+    """
+
+    def __init__(self):
+        self.index = None
+
+    def build_index(self):
+        catalogue = ParameterCatalogue.load()
+        self.index = {}
+        for name, default in pyscipopt.Model().getParams().items():
+            if name in catalogue:
+                self.index[name] = (catalogue[name].type, catalogue[name].range)
+            elif isinstance(default, bool):
+                self.index[name] = ('bool', None)
+            elif isinstance(default, int):
+                self.index[name] = ('int', None)
+            elif isinstance(default, float):
+                self.index[name] = ('real', None)
+            else:
+                self.index[name] = ('string', None)
+
+    @staticmethod
+    def check(param_type, param_range, value):
+        """Whether a value is valid for a parameter of the given type and range."""
+        if param_type == 'bool':
+            return isinstance(value, (bool, np.bool_)) or (isinstance(value, numbers.Integral) and value in (0, 1))
+        elif param_type in ('int', 'longint'):
+            valid = isinstance(value, numbers.Integral) and not isinstance(value, (bool, np.bool_))
+        elif param_type == 'real':
+            valid = isinstance(value, numbers.Real) and not isinstance(value, (bool, np.bool_))
+        elif param_type == 'char':
+            return isinstance(value, str) and len(value) == 1 and (param_range is None or value in param_range)
+        else:
+            return isinstance(value, str)
+        return valid and (param_range is None or param_range[0] <= value <= param_range[1])
+
+    def validate(self, action):
+        """
+        Checks all the parameters of an action at once.
+
+        Raises
+        ------
+        ValueError
+            If any parameter is forbidden, unknown, or has an invalid value, listing all of them.
+        """
+        if self.index is None:
+            self.build_index()
+
+        errors = []
+        for name, value in action.items():
+            if name in FORBIDDEN_PARAMS:
+                errors.append(f"setting '{name}' is forbidden")
+            elif name not in self.index:
+                errors.append(f"'{name}' is not a SCIP parameter")
+            else:
+                param_type, param_range = self.index[name]
+                if not self.check(param_type, param_range, value):
+                    expected = f"{param_type} in {param_range}" if param_range is not None else param_type
+                    errors.append(f"invalid value {value!r} for '{name}' ({expected})")
+
+        if errors:
+            raise ValueError("Invalid SCIP parameters: " + "; ".join(errors) + ".")
+
+
+# shared by all environments in the process
+parameter_validator = ParameterValidator()
+
 
 class DefaultInformationFunction():
 
@@ -113,18 +265,7 @@ class ConfiguringDynamics(ecole.dynamics.ConfiguringDynamics):
         return done, action_set
 
     def step_dynamics(self, model, action):
-        forbidden_params = [
-            "limits/time",
-            "timing/clocktype",
-            "timing/enabled",
-            "timing/reading",
-            "timing/rareclockcheck",
-            "timing/statistictiming",
-            "limits/memory"]
-
-        for param in forbidden_params:
-            if param in action:
-                raise ValueError(f"Setting the SCIP parameter '{param}' is forbidden.")
+        parameter_validator.validate(action)
 
         done, action_set = super().step_dynamics(model, action)
 
@@ -140,7 +281,7 @@ class ObjectiveLimitEnvironment(ecole.environment.Environment):
             if isinstance(instance, ecole.core.scip.Model):
                 self.model = instance.copy_orig()
             else:
-                self.model = ecole.core.scip.Model.from_file(instance)
+                self.model = instance_cache.get(instance)
             self.model.set_params(self.scip_params)
 
             # >>> changes specific to this environment
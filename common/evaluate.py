@@ -1,12 +1,243 @@
 import argparse
 import csv
+import io
 import json
+import multiprocessing
+import os
 import pathlib
+import queue
+import sys
+import time
 
 import ecole as ec
 import numpy as np
 
 
+def setup_task(task):
+    """Import the proper agent, environment and goal for the task."""
+    if task == "primal":
+        from agents.primal import Policy, ObservationFunction
+        from environments import RootPrimalSearch as Environment
+        from rewards import TimeLimitPrimalIntegral as BoundIntegral
+        time_limit = 5*60
+        memory_limit = 8796093022207  # maximum
+
+    elif task == "dual":
+        from agents.dual import Policy, ObservationFunction
+        from environments import Branching as Environment
+        from rewards import TimeLimitDualIntegral as BoundIntegral
+        time_limit = 15*60
+        memory_limit = 8796093022207  # maximum
+
+    elif task == "config":
+        from agents.config import Policy, ObservationFunction
+        from environments import Configuring as Environment
+        from rewards import TimeLimitPrimalDualIntegral as BoundIntegral
+        time_limit = 15*60
+        memory_limit = 12*1024  # 12 GiB, early stop SCIP before it triggers an OOM kill (20GB)
+
+    return Policy, ObservationFunction, Environment, BoundIntegral, time_limit, memory_limit
+
+
+class TimedFunction():
+    """Wraps an observation or reward function, and records the wall time of each extraction."""
+
+    def __init__(self, function):
+        self.function = function
+        self.times = []
+
+    def seed(self, seed):
+        self.function.seed(seed)
+
+    def before_reset(self, model):
+        self.function.before_reset(model)
+
+    def extract(self, model, done):
+        start = time.perf_counter()
+        value = self.function.extract(model, done)
+        self.times.append(time.perf_counter() - start)
+        return value
+
+
+def get_trace_file(traces_dir, instance, seed):
+    return pathlib.Path(traces_dir) / f"{pathlib.Path(instance.stem).stem}_{seed}.npz"
+
+
+def print_trace_summary(trace_files):
+    """Print percentiles of the per-step timings over all the given episode traces."""
+    traces = [np.load(trace_file) for trace_file in trace_files]
+    components = ['observation', 'policy', 'solver', 'reward']
+
+    print()
+    print(f"Per-step wall times (ms), {sum(len(trace['policy']) for trace in traces)} steps over {len(traces)} episodes")
+    print(f"  {'':12} {'mean':>10} {'p50':>10} {'p90':>10} {'p99':>10} {'max':>10}")
+    for component in ['reset'] + components:
+        times = np.concatenate([np.atleast_1d(trace[component]) for trace in traces]) * 1000
+        if len(times) == 0:
+            continue
+        print(f"  {component:12} {times.mean():10.3f} " + " ".join(
+            f"{value:10.3f}" for value in np.percentile(times, [50, 90, 99, 100])))
+
+
+def evaluate_instance(task, problem, seed, instance, time_limit=None, debug=False, trace_file=None, trajectory_file=None):
+    """
+    Run a single evaluation episode, and return the corresponding results row.
+    If a trace file is given, per-step wall times are recorded and saved to it.
+    If a trajectory file is given, the bound trajectory is recorded and saved to it.
+    """
+    Policy, ObservationFunction, Environment, BoundIntegral, default_time_limit, memory_limit = setup_task(task)
+
+    # override from command-line argument if provided
+    if time_limit is None:
+        time_limit = default_time_limit
+
+    observation_function = ObservationFunction(problem=problem)
+    policy = Policy(problem=problem)
+
+    integral_function = BoundIntegral()
+    integral_function.set_trajectory_file(trajectory_file)
+    reward_function = -integral_function  # negated integral (minimization)
+
+    if trace_file is not None:
+        observation_function = TimedFunction(observation_function)
+        reward_function = TimedFunction(reward_function)
+        timings = {'observation': [], 'policy': [], 'solver': [], 'reward': []}
+
+    env = Environment(
+        time_limit=time_limit,
+        observation_function=observation_function,
+        reward_function=reward_function,
+        scip_params={'limits/memory': memory_limit},
+    )
+
+    # seed both the agent and the environment (deterministic behavior)
+    observation_function.seed(seed)
+    policy.seed(seed)
+    env.seed(seed)
+
+    # read the instance's initial primal and dual bounds from JSON file
+    with open(instance.with_name(instance.stem).with_suffix('.json')) as f:
+        instance_info = json.load(f)
+
+    # set up the reward function parameters for that instance
+    initial_primal_bound = instance_info["primal_bound"]
+    initial_dual_bound = instance_info["dual_bound"]
+    objective_offset = 0
+
+    integral_function.set_parameters(
+            initial_primal_bound=initial_primal_bound,
+            initial_dual_bound=initial_dual_bound,
+            objective_offset=objective_offset)
+
+    print()
+    print(f"Instance {instance.name}")
+    print(f"  seed: {seed}")
+    print(f"  initial primal bound: {initial_primal_bound}")
+    print(f"  initial dual bound: {initial_dual_bound}")
+    print(f"  objective offset: {objective_offset}")
+
+    # reset the environment
+    start = time.perf_counter()
+    observation, action_set, reward, done, info = env.reset(str(instance), objective_limit=initial_primal_bound)
+    reset_time = time.perf_counter() - start
+
+    if debug:
+        print(f"  info: {info}")
+        print(f"  reward: {reward}")
+        print(f"  action_set: {action_set}")
+
+    cumulated_reward = 0  # discard initial reward
+
+    # loop over the environment
+    while not done:
+        start = time.perf_counter()
+        action = policy(action_set, observation)
+        policy_time = time.perf_counter() - start
+
+        if debug:
+            print(f"  action: {action}")
+
+        if trace_file is not None:
+            n_observations, n_rewards = len(observation_function.times), len(reward_function.times)
+
+        start = time.perf_counter()
+        observation, action_set, reward, done, info = env.step(action)
+        step_time = time.perf_counter() - start
+
+        if trace_file is not None:
+            # the solver time is what remains of the step once data extraction is accounted for
+            observation_time = sum(observation_function.times[n_observations:])
+            reward_time = sum(reward_function.times[n_rewards:])
+            timings['observation'].append(observation_time)
+            timings['policy'].append(policy_time)
+            timings['solver'].append(step_time - observation_time - reward_time)
+            timings['reward'].append(reward_time)
+
+        if debug:
+            print(f"  info: {info}")
+            print(f"  reward: {reward}")
+            print(f"  action_set: {action_set}")
+
+        cumulated_reward += reward
+
+    print(f"  cumulated reward (to be maximized): {cumulated_reward}")
+
+    if trace_file is not None:
+        np.savez_compressed(trace_file, reset=reset_time, **{k: np.asarray(v) for k, v in timings.items()})
+
+    return {
+        'instance': str(instance),
+        'seed': seed,
+        'initial_primal_bound': initial_primal_bound,
+        'initial_dual_bound': initial_dual_bound,
+        'objective_offset': objective_offset,
+        'cumulated_reward': cumulated_reward,
+    }
+
+
+def init_worker(cpus_queue, submission_dir):
+    """Pool initializer: pin the worker to its own set of CPUs, and make the agent importable."""
+    sys.path.insert(1, submission_dir)
+
+    # pin each worker to a disjoint set of CPUs, so that wall-clock integrals remain comparable
+    try:
+        cpus = cpus_queue.get(timeout=10)
+    except queue.Empty:  # respawned worker, all CPU chunks already taken
+        cpus = None
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+
+
+def evaluate_instance_star(kwargs):
+    return evaluate_instance(**kwargs)
+
+
+def read_results(results_file, fieldnames):
+    """Read the rows of an existing results file, dropping a partially written trailing row if any."""
+    with open(results_file, mode='rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b'\n'):
+            # crash in the middle of a write, discard the incomplete row
+            f.truncate(content.rfind(b'\n') + 1)
+
+    with open(results_file, mode='r', newline='') as csv_file:
+        reader = csv.DictReader(csv_file)
+        assert reader.fieldnames == fieldnames, f"Unexpected header in {results_file}: {reader.fieldnames}."
+        return list(reader)
+
+
+def append_result(results_file, fieldnames, row):
+    """Append a row to the results file, in a single write followed by a fsync."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writerow(row)
+
+    with open(results_file, mode='a', newline='') as csv_file:
+        csv_file.write(buffer.getvalue())
+        csv_file.flush()
+        os.fsync(csv_file.fileno())
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -37,6 +268,27 @@ if __name__ == '__main__':
         type=str,
         choices=("valid", "test"),
     )
+    parser.add_argument(
+        '-r', '--resume',
+        help='Resume from an existing results file, skipping the episodes already evaluated.',
+        action='store_true',
+    )
+    parser.add_argument(
+        '-p', '--profile',
+        help='Record per-step wall times of each episode, and print a summary at the end.',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--trajectories',
+        help='Record the bound trajectory of each episode, for offline rescoring.',
+        action='store_true',
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        help='Number of episodes to evaluate in parallel worker processes (each pinned to its own CPUs).',
+        default=1,
+        type=int,
+    )
     args = parser.parse_args()
 
     # check the Ecole version installed
@@ -56,124 +308,71 @@ if __name__ == '__main__':
         results_file = pathlib.Path(f"results/{args.task}/3_anonymous.csv")
 
     print(f"Processing instances from {instances_path.resolve()}")
-    instance_files = list(instances_path.glob('*.mps.gz'))
+    instance_files = sorted(instances_path.glob('*.mps.gz'))  # fixed order, so that seeds are reproducible
 
-    if args.problem == 'anonymous': 
+    if args.problem == 'anonymous':
         # special case: evaluate the anonymous instances five times with different seeds
         instance_files = instance_files * 5
 
     print(f"Saving results to {results_file.resolve()}")
     results_file.parent.mkdir(parents=True, exist_ok=True)
     results_fieldnames = ['instance', 'seed', 'initial_primal_bound', 'initial_dual_bound', 'objective_offset', 'cumulated_reward']
-    with open(results_file, mode='w') as csv_file:
-        writer = csv.DictWriter(csv_file, fieldnames=results_fieldnames)
-        writer.writeheader()
-
-    import sys
-    sys.path.insert(1, str(pathlib.Path.cwd()))
-
-    # set up the proper agent, environment and goal for the task
-    if args.task == "primal":
-        from agents.primal import Policy, ObservationFunction
-        from environments import RootPrimalSearch as Environment
-        from rewards import TimeLimitPrimalIntegral as BoundIntegral
-        time_limit = 5*60
-        memory_limit = 8796093022207  # maximum
-
-    elif args.task == "dual":
-        from agents.dual import Policy, ObservationFunction
-        from environments import Branching as Environment
-        from rewards import TimeLimitDualIntegral as BoundIntegral
-        time_limit = 15*60
-        memory_limit = 8796093022207  # maximum
-
-    elif args.task == "config":
-        from agents.config import Policy, ObservationFunction
-        from environments import Configuring as Environment
-        from rewards import TimeLimitPrimalDualIntegral as BoundIntegral
-        time_limit = 15*60
-        memory_limit = 12*1024  # 12 GiB, early stop SCIP before it triggers an OOM kill (20GB)
-
-    # override from command-line argument if provided
-    time_limit = getattr(args, "timelimit", time_limit)
+    if args.resume and results_file.exists() and results_file.stat().st_size > 0:
+        done_episodes = {(row['instance'], int(row['seed'])) for row in read_results(results_file, results_fieldnames)}
+        print(f"Resuming, {len(done_episodes)} episodes already evaluated")
+    else:
+        done_episodes = set()
+        with open(results_file, mode='w') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=results_fieldnames)
+            writer.writeheader()
+
+    if args.profile:
+        traces_dir = results_file.with_name(f"{results_file.stem}_traces")
+        traces_dir.mkdir(exist_ok=True)
+        print(f"Saving per-step traces to {traces_dir.resolve()}")
+
+    if args.trajectories:
+        trajectories_dir = results_file.with_name(f"{results_file.stem}_trajectories")
+        trajectories_dir.mkdir(exist_ok=True)
+        print(f"Saving bound trajectories to {trajectories_dir.resolve()}")
+
+    submission_dir = str(pathlib.Path.cwd())
+    sys.path.insert(1, submission_dir)
+
+    # seeds are tied to the instance order, whether episodes are evaluated serially or in parallel
+    episodes = [{
+        'task': args.task,
+        'problem': args.problem,
+        'seed': seed,
+        'instance': instance,
+        'time_limit': getattr(args, "timelimit", None),
+        'debug': args.debug,
+        'trace_file': get_trace_file(traces_dir, instance, seed) if args.profile else None,
+        'trajectory_file': get_trace_file(trajectories_dir, instance, seed) if args.trajectories else None,
+    } for seed, instance in enumerate(instance_files) if (str(instance), seed) not in done_episodes]
 
     # evaluation loop
-    for seed, instance in enumerate(instance_files):
-
-        observation_function = ObservationFunction(problem=args.problem)
-        policy = Policy(problem=args.problem)
-
-        integral_function = BoundIntegral()
-
-        env = Environment(
-            time_limit=time_limit,
-            observation_function=observation_function,
-            reward_function=-integral_function,  # negated integral (minimization)
-            scip_params={'limits/memory': memory_limit},
-        )
-
-        # seed both the agent and the environment (deterministic behavior)
-        observation_function.seed(seed)
-        policy.seed(seed)
-        env.seed(seed)
-
-        # read the instance's initial primal and dual bounds from JSON file
-        with open(instance.with_name(instance.stem).with_suffix('.json')) as f:
-            instance_info = json.load(f)
-
-        # set up the reward function parameters for that instance
-        initial_primal_bound = instance_info["primal_bound"]
-        initial_dual_bound = instance_info["dual_bound"]
-        objective_offset = 0
-
-        integral_function.set_parameters(
-                initial_primal_bound=initial_primal_bound,
-                initial_dual_bound=initial_dual_bound,
-                objective_offset=objective_offset)
-
-        print()
-        print(f"Instance {instance.name}")
-        print(f"  seed: {seed}")
-        print(f"  initial primal bound: {initial_primal_bound}")
-        print(f"  initial dual bound: {initial_dual_bound}")
-        print(f"  objective offset: {objective_offset}")
-
-        # reset the environment
-        observation, action_set, reward, done, info = env.reset(str(instance), objective_limit=initial_primal_bound)
-
-        if args.debug:
-            print(f"  info: {info}")
-            print(f"  reward: {reward}")
-            print(f"  action_set: {action_set}")
+    if args.jobs > 1:
+        # split the available CPUs into one disjoint chunk per worker
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        assert not cpus or args.jobs <= len(cpus), f"Cannot run {args.jobs} jobs on {len(cpus)} CPUs."
 
-        cumulated_reward = 0  # discard initial reward
+        cpus_queue = multiprocessing.Queue()
+        for i in range(args.jobs):
+            cpus_queue.put(set(np.array_split(cpus, args.jobs)[i].tolist()) if cpus else None)
 
-        # loop over the environment
-        while not done:
-            action = policy(action_set, observation)
+        pool = multiprocessing.Pool(args.jobs, initializer=init_worker, initargs=(cpus_queue, submission_dir))
+        results = pool.imap_unordered(evaluate_instance_star, episodes)
+    else:
+        results = map(evaluate_instance_star, episodes)
 
-            if args.debug:
-                print(f"  action: {action}")
-
-            observation, action_set, reward, done, info = env.step(action)
-
-            if args.debug:
-                print(f"  info: {info}")
-                print(f"  reward: {reward}")
-                print(f"  action_set: {action_set}")
-
-            cumulated_reward += reward
+    for result in results:
+        # save instance results
+        append_result(results_file, results_fieldnames, result)
 
-        print(f"  cumulated reward (to be maximized): {cumulated_reward}")
+    if args.jobs > 1:
+        pool.close()
+        pool.join()
 
-        # save instance results
-        with open(results_file, mode='a') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=results_fieldnames)
-            writer.writerow({
-                'instance': str(instance),
-                'seed': seed,
-                'initial_primal_bound': initial_primal_bound,
-                'initial_dual_bound': initial_dual_bound,
-                'objective_offset': objective_offset,
-                'cumulated_reward': cumulated_reward,
-            })
+    if args.profile and episodes:
+        print_trace_summary([episode['trace_file'] for episode in episodes])
@@ -0,0 +1,263 @@
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import pathlib
+import time
+
+import numpy as np
+
+
+PROBLEM_DIRS = {'item_placement': '1_item_placement', 'load_balancing': '2_load_balancing', 'anonymous': '3_anonymous'}
+PROBLEMS = {problem_dir: problem for problem, problem_dir in PROBLEM_DIRS.items()}
+
+# static features of each instance, computed on the original problem (as read, before presolve)
+FEATURES = {
+    'objective_sense': np.int64,    # 1 for minimization, -1 for maximization
+    'n_vars': np.int64,
+    'n_binvars': np.int64,
+    'n_intvars': np.int64,
+    'n_implvars': np.int64,
+    'n_contvars': np.int64,
+    'n_conss': np.int64,
+    'n_equalities': np.int64,
+    'n_nonlinear_conss': np.int64,  # not linear, their coefficients are not in the statistics
+    'n_nonzeros': np.int64,
+    'density': np.float64,          # n_nonzeros / (n_vars * n_conss)
+    'row_nnz_mean': np.float64,
+    'row_nnz_max': np.int64,
+    'col_nnz_mean': np.float64,
+    'col_nnz_max': np.int64,
+    'coef_abs_min': np.float64,
+    'coef_abs_max': np.float64,
+    'coef_abs_mean': np.float64,
+    'coef_abs_std': np.float64,
+    'obj_nonzeros': np.int64,
+    'obj_abs_min': np.float64,      # objective statistics are over nonzero coefficients
+    'obj_abs_max': np.float64,
+    'obj_abs_mean': np.float64,
+    'obj_abs_std': np.float64,
+    'n_finite_lb': np.int64,
+    'n_finite_ub': np.int64,
+    'primal_bound': np.float64,     # initial bounds, from the instance's JSON file
+    'dual_bound': np.float64,
+}
+
+# identification columns, along with the features
+ID_COLUMNS = ['instance', 'problem', 'folder', 'name']
+
+
+def abs_stats(values):
+    """(min, max, mean, std) of the absolute values, zeros if there are none."""
+    if len(values) == 0:
+        return 0., 0., 0., 0.
+    values = np.abs(values)
+    return values.min(), values.max(), values.mean(), values.std()
+
+
+def extract_features(instance):
+    """
+    Reads an instance with SCIP, without solving it, and computes its static features.
+
+    Parameters
+    ----------
+    instance : str
+        Path of the instance (.mps.gz), next to its JSON file of initial bounds.
+
+    Returns
+    -------
+    name : str
+        SCIP's problem name of the instance, by which agents look it up.
+    features : dict
+        Value of each feature in FEATURES.
+    """
+    import pyscipopt
+
+    m = pyscipopt.Model()
+    m.hideOutput()
+    m.readProblem(instance)
+
+    variables = m.getVars()
+    var_index = {var.name: i for i, var in enumerate(variables)}
+    inf = m.infinity()
+
+    # constraint matrix, one linear row at a time
+    rows, cols, coefs = [], [], []
+    n_equalities, n_nonlinear = 0, 0
+    for i, cons in enumerate(m.getConss()):
+        if cons.getConshdlrName() != 'linear':
+            n_nonlinear += 1
+            continue
+        row = m.getValsLinear(cons)
+        rows.append(np.full(len(row), i))
+        cols.append(np.fromiter((var_index[name] for name in row), dtype=np.int64, count=len(row)))
+        coefs.append(np.fromiter(row.values(), dtype=np.float64, count=len(row)))
+        n_equalities += m.getLhs(cons) == m.getRhs(cons)
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    coefs = np.concatenate(coefs) if coefs else np.zeros(0)
+    nonzeros = coefs != 0
+    rows, cols, coefs = rows[nonzeros], cols[nonzeros], coefs[nonzeros]
+
+    n_vars, n_conss = len(variables), m.getNConss()
+    row_nnz = np.bincount(rows, minlength=n_conss)
+    col_nnz = np.bincount(cols, minlength=n_vars)
+
+    vtypes = collections.Counter(map(pyscipopt.scip.Variable.vtype, variables))
+    objs = np.fromiter(map(pyscipopt.scip.Variable.getObj, variables), dtype=np.float64, count=n_vars)
+    objs = objs[objs != 0]
+    lbs = np.fromiter(map(pyscipopt.scip.Variable.getLbOriginal, variables), dtype=np.float64, count=n_vars)
+    ubs = np.fromiter(map(pyscipopt.scip.Variable.getUbOriginal, variables), dtype=np.float64, count=n_vars)
+
+    instance = pathlib.Path(instance)
+    with open(instance.with_name(instance.stem).with_suffix('.json')) as f:
+        instance_info = json.load(f)
+
+    features = dict(zip(FEATURES, [
+        1 if m.getObjectiveSense() == "minimize" else -1,
+        n_vars, vtypes['BINARY'], vtypes['INTEGER'], vtypes['IMPLINT'], vtypes['CONTINUOUS'],
+        n_conss, n_equalities, n_nonlinear,
+        len(rows), len(rows) / max(n_vars * n_conss, 1),
+        row_nnz.mean() if n_conss else 0., row_nnz.max(initial=0),
+        col_nnz.mean() if n_vars else 0., col_nnz.max(initial=0),
+        *abs_stats(coefs),
+        len(objs), *abs_stats(objs),
+        np.count_nonzero(lbs > -inf), np.count_nonzero(ubs < inf),
+        instance_info["primal_bound"], instance_info["dual_bound"],
+    ]))
+    return m.getProbName(), features
+
+
+def extract_features_star(instance):
+    return (str(instance), *extract_features(str(instance)))
+
+
+def build_index(instance_files, features_file, n_jobs=1):
+    """
+    Extracts the features of the instances in parallel worker processes, and saves them to
+    a single .npz file, with one array per column and one row per instance.
+    """
+    columns = {column: [] for column in ID_COLUMNS + list(FEATURES)}
+    with multiprocessing.Pool(n_jobs) as pool:
+        # rows in a fixed order, whichever worker finishes first
+        for instance, name, features in sorted(pool.imap_unordered(extract_features_star, instance_files, chunksize=4)):
+            instance = pathlib.Path(instance)
+            columns['instance'].append(instance.name)
+            columns['problem'].append(PROBLEMS[instance.parent.parent.name])
+            columns['folder'].append(instance.parent.name)
+            columns['name'].append(name)
+            for feature, value in features.items():
+                columns[feature].append(value)
+
+    np.savez_compressed(
+        features_file,
+        **{column: np.asarray(columns[column], dtype=str) for column in ID_COLUMNS},
+        **{feature: np.asarray(columns[feature], dtype=dtype) for feature, dtype in FEATURES.items()})
+
+
+class InstanceFeatures():
+    """
+    Index of precomputed instance features, loaded once, in which an agent looks up the
+    features of the current instance in O(1) at the start of an episode. Instances are found
+    by file name, when the path of the instance is known, otherwise by SCIP problem name
+    (Model.getProbName(), the NAME of the MPS file, or its path if there is none). A problem
+    name shared by several instances is ambiguous and not indexed: such instances are only
+    found by file name, and looking them up by model alone returns None.
+
+    Parameters
+    ----------
+    features_file : str
+        File written by build_index.
+    """
+
+    def __init__(self, features_file):
+        with np.load(features_file) as data:
+            self.columns = {column: data[column] for column in data.files}
+        self.matrix = np.stack([self.columns[feature].astype(np.float64) for feature in FEATURES], axis=1)
+
+        self.rows = {}
+        names, counts = np.unique(self.columns['name'], return_counts=True)
+        ambiguous = set(names[counts > 1])
+        for row, (name, instance) in enumerate(zip(self.columns['name'], self.columns['instance'])):
+            self.rows[instance] = row
+            if name not in ambiguous:
+                self.rows[name] = row
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def row(self, key):
+        """Row of an instance, by problem name or file name, None if not indexed."""
+        return self.rows.get(key)
+
+    def find(self, model, instance=None):
+        """
+        Row of the instance of an ecole or pyscipopt model, by the file name of its path if
+        given, then by problem name, then by the file name in the problem name. None if the
+        instance is not indexed (e.g. a test instance) or its problem name is ambiguous.
+        """
+        if instance is not None:
+            row = self.row(os.path.basename(instance))
+            if row is not None:
+                return row
+        if hasattr(model, 'as_pyscipopt'):
+            model = model.as_pyscipopt()
+        name = model.getProbName()
+        row = self.row(name)
+        return row if row is not None else self.row(os.path.basename(name))
+
+    def lookup(self, model, instance=None):
+        """
+        Features of the instance of a model, as a dict, None if not found (see find).
+        """
+        row = self.find(model, instance)
+        if row is None:
+            return None
+        return {feature: self.columns[feature][row].item() for feature in FEATURES}
+
+    def vector(self, model, instance=None):
+        """Features of the instance of a model, in the order of FEATURES, as a float64 array, None if not found."""
+        row = self.find(model, instance)
+        return None if row is None else self.matrix[row]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-p', '--problems',
+        help='Problem benchmarks to index.',
+        nargs='+',
+        choices=list(PROBLEM_DIRS),
+        default=list(PROBLEM_DIRS),
+    )
+    parser.add_argument(
+        '-i', '--instances',
+        help='Instance folder.',
+        default='../../instances',
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help='Output features file (INSTANCES/features.npz by default).',
+        default=None,
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        help='Number of instances processed in parallel worker processes.',
+        default=multiprocessing.cpu_count(),
+        type=int,
+    )
+    args = parser.parse_args()
+
+    features_file = args.output or args.instances / 'features.npz'
+
+    instance_files = []
+    for problem in args.problems:
+        instance_files += sorted((args.instances / PROBLEM_DIRS[problem]).glob('*/*.mps.gz'))
+    print(f"Indexing {len(instance_files)} instances from {args.instances.resolve()} with {args.jobs} jobs")
+
+    start_time = time.time()
+    build_index(instance_files, features_file, args.jobs)
+    print(f"Features of {len(instance_files)} instances saved to {features_file.resolve()} in {time.time() - start_time:.1f}s")
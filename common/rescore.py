@@ -0,0 +1,122 @@
+import argparse
+import csv
+import pathlib
+
+import numpy as np
+
+
+def load_trajectories(trajectory_files):
+    """
+    Load bound trajectories saved by the reward functions, and concatenate them into
+    flat arrays. Points are tagged with the index of their episode in 'episode', while
+    the integral parameters are stored as one value per episode.
+    """
+    trajectory_files = list(trajectory_files)
+    if not trajectory_files:
+        raise ValueError("No bound trajectory files to load.")
+
+    episodes = {key: [] for key in ['time', 'primal_bound', 'dual_bound']}
+    parameters = {key: [] for key in ['start_time', 'time_limit', 'sense', 'offset', 'initial_primal_bound', 'initial_dual_bound']}
+
+    for trajectory_file in trajectory_files:
+        with np.load(trajectory_file) as trajectory:
+            for key in episodes:
+                episodes[key].append(trajectory[key])
+            for key in parameters:
+                parameters[key].append(trajectory[key])
+
+    trajectories = {key: np.concatenate(values) for key, values in episodes.items()}
+    trajectories.update({key: np.asarray(values, dtype=np.float64) for key, values in parameters.items()})
+    trajectories['episode'] = np.repeat(np.arange(len(episodes['time'])), [len(t) for t in episodes['time']])
+
+    return trajectories
+
+
+def rescore(trajectories, objective_offset=None, initial_primal_bound=None, initial_dual_bound=None, time_limit=None):
+    """
+    Recompute the primal, dual and primal-dual integrals of each episode from its
+    bound trajectory. Any parameter left to None takes the value recorded with the
+    trajectory, otherwise it can be a scalar or an array with one value per episode.
+    The time limit can only be truncated, since the solver was not run any further.
+
+    Returns
+    -------
+    primal_integral, dual_integral, primal_dual_integral : np.ndarray
+        Integrals of each episode (to be minimized).
+    """
+    n_episodes = len(trajectories['start_time'])
+
+    def per_episode(value, key):
+        value = trajectories[key] if value is None else value
+        return np.broadcast_to(np.asarray(value, dtype=np.float64), (n_episodes,))
+
+    offset = per_episode(objective_offset, 'offset')
+    initial_primal_bound = per_episode(initial_primal_bound, 'initial_primal_bound')
+    initial_dual_bound = per_episode(initial_dual_bound, 'initial_dual_bound')
+    time_limit = per_episode(time_limit, 'time_limit')
+
+    if np.any(time_limit > trajectories['time_limit'] + 1e-9):
+        raise ValueError("The time limit cannot exceed the one of the recorded episodes.")
+
+    episode = trajectories['episode']
+    times = trajectories['time']
+    sense = trajectories['sense'][episode]
+
+    # each bound holds until the next point of its episode, the last one until the time limit
+    next_times = np.append(times[1:], np.inf)
+    next_times[np.append(episode[1:] != episode[:-1], True)] = np.inf
+
+    start = trajectories['start_time'][episode]
+    end = start + time_limit[episode]
+    durations = np.clip(next_times, start, end) - np.clip(times, start, end)
+
+    # work in the minimization sense
+    primal_bound = np.minimum(sense * trajectories['primal_bound'], sense * initial_primal_bound[episode])
+    dual_bound = np.maximum(sense * trajectories['dual_bound'], sense * initial_dual_bound[episode])
+    offset = sense * offset[episode]
+
+    def integrate(values):
+        return np.bincount(episode, weights=np.where(durations > 0, values * durations, 0), minlength=n_episodes)
+
+    primal_integral = integrate(primal_bound - offset)
+    dual_integral = integrate(offset - dual_bound)
+    primal_dual_integral = integrate(primal_bound - dual_bound)
+
+    return primal_integral, dual_integral, primal_dual_integral
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'trajectories',
+        help='Folder containing the bound trajectory (.npz) files to rescore.',
+        type=pathlib.Path,
+    )
+    parser.add_argument(
+        '-t', '--timelimit',
+        help='Truncated episode time limit (in seconds).',
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        '-o', '--output',
+        help='Output CSV file.',
+        default='rescored.csv',
+        type=str,
+    )
+    args = parser.parse_args()
+
+    trajectory_files = sorted(args.trajectories.glob('*.npz'))
+    if not trajectory_files:
+        raise SystemExit(f"No bound trajectory (.npz) files found in {args.trajectories.resolve()}.")
+    print(f"Rescoring {len(trajectory_files)} trajectories from {args.trajectories.resolve()}")
+
+    trajectories = load_trajectories(trajectory_files)
+    integrals = rescore(trajectories, time_limit=args.timelimit)
+
+    print(f"Saving results to {pathlib.Path(args.output).resolve()}")
+    with open(args.output, mode='w') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['trajectory', 'primal_integral', 'dual_integral', 'primal_dual_integral'])
+        for trajectory_file, values in zip(trajectory_files, zip(*integrals)):
+            writer.writerow([trajectory_file.name, *values])
@@ -1,4 +1,5 @@
 import ecole
+import numpy as np
 import pyscipopt
 
 
@@ -27,10 +28,85 @@ class IntegralParameters():
             self.initial_dual_bound = -m.infinity() if m.getObjectiveSense() == "minimize" else m.infinity()
 
 
+def get_bounds(m):
+    if m.getStage() < pyscipopt.scip.PY_SCIP_STAGE.TRANSFORMED:
+        primal_bound = m.getObjlimit()
+        dual_bound = -m.infinity() if m.getObjectiveSense() == "minimize" else m.infinity()
+    else:
+        primal_bound = m.getPrimalbound()
+        dual_bound = m.getDualbound()
+    return primal_bound, dual_bound
+
+
+class BoundTrajectoryEventHandler(pyscipopt.Eventhdlr):
+    """Records a point of the bound trajectory each time a new solution is found or a node is solved."""
+
+    def __init__(self, trajectory):
+        self.trajectory = trajectory
+
+    def eventinit(self):
+        self.model.catchEvent(pyscipopt.SCIP_EVENTTYPE.BESTSOLFOUND, self)
+        self.model.catchEvent(pyscipopt.SCIP_EVENTTYPE.NODESOLVED, self)
+
+    def eventexit(self):
+        self.model.dropEvent(pyscipopt.SCIP_EVENTTYPE.BESTSOLFOUND, self)
+        self.model.dropEvent(pyscipopt.SCIP_EVENTTYPE.NODESOLVED, self)
+
+    def eventexec(self, event):
+        self.trajectory.record(self.model)
+
+
+class BoundTrajectory():
+    """
+    Records the (solving time, primal bound, dual bound) trajectory of an episode, and
+    saves it to a .npz file along with the integral parameters once the episode is over.
+    Only the points where one of the bounds changes are kept.
+    """
+
+    def __init__(self, trajectory_file):
+        self.trajectory_file = trajectory_file
+
+    def before_reset(self, model):
+        self.points = []
+        self.start_time = None
+        self.record(model.as_pyscipopt())
+
+        self.event_handler = BoundTrajectoryEventHandler(self)
+        model.as_pyscipopt().includeEventhdlr(self.event_handler, "boundtrajectory", "records the bound trajectory")
+
+    def record(self, m):
+        primal_bound, dual_bound = get_bounds(m)
+        if not self.points or self.points[-1][1:] != (primal_bound, dual_bound):
+            self.points.append((m.getSolvingTime(), primal_bound, dual_bound))
+
+    def extract(self, model, done, parameters):
+        m = model.as_pyscipopt()
+        self.record(m)
+
+        # the integrals start once the environment has been reset
+        if self.start_time is None:
+            self.start_time = m.getSolvingTime()
+
+        if done:
+            points = np.asarray(self.points, dtype=np.float64).reshape(-1, 3)
+            np.savez_compressed(
+                self.trajectory_file,
+                time=points[:, 0],
+                primal_bound=points[:, 1],
+                dual_bound=points[:, 2],
+                start_time=self.start_time,
+                time_limit=m.getParam("limits/time") - self.start_time,
+                sense=1 if m.getObjectiveSense() == "minimize" else -1,
+                offset=parameters.offset,
+                initial_primal_bound=parameters.initial_primal_bound,
+                initial_dual_bound=parameters.initial_dual_bound)
+
+
 class TimeLimitPrimalIntegral(ecole.reward.PrimalIntegral):
 
     def __init__(self):
         self.parameters = IntegralParameters()
+        self.trajectory = None
         super().__init__(wall=True, bound_function=lambda model: (
             self.parameters.offset,
             self.parameters.initial_primal_bound))
@@ -41,13 +117,22 @@ class TimeLimitPrimalIntegral(ecole.reward.PrimalIntegral):
             initial_primal_bound=initial_primal_bound,
             initial_dual_bound=initial_dual_bound)
 
+    def set_trajectory_file(self, trajectory_file=None):
+        """Record the bound trajectory of the next episodes to the given file (None to disable)."""
+        self.trajectory = BoundTrajectory(trajectory_file) if trajectory_file is not None else None
+
     def before_reset(self, model):
         self.parameters.fetch_values(model)
+        if self.trajectory is not None:
+            self.trajectory.before_reset(model)
         super().before_reset(model)
 
     def extract(self, model, done):
         reward = super().extract(model, done)
 
+        if self.trajectory is not None:
+            self.trajectory.extract(model, done, self.parameters)
+
         # adjust the final reward if the time limit has not been reached
         if done:
             m = model.as_pyscipopt()
@@ -74,6 +159,7 @@ class TimeLimitDualIntegral(ecole.reward.DualIntegral):
 
     def __init__(self):
         self.parameters = IntegralParameters()
+        self.trajectory = None
         super().__init__(wall=True, bound_function=lambda model: (
             self.parameters.offset,
             self.parameters.initial_dual_bound))
@@ -84,13 +170,22 @@ class TimeLimitDualIntegral(ecole.reward.DualIntegral):
             initial_primal_bound=initial_primal_bound,
             initial_dual_bound=initial_dual_bound)
 
+    def set_trajectory_file(self, trajectory_file=None):
+        """Record the bound trajectory of the next episodes to the given file (None to disable)."""
+        self.trajectory = BoundTrajectory(trajectory_file) if trajectory_file is not None else None
+
     def before_reset(self, model):
         self.parameters.fetch_values(model)
+        if self.trajectory is not None:
+            self.trajectory.before_reset(model)
         super().before_reset(model)
 
     def extract(self, model, done):
         reward = super().extract(model, done)
 
+        if self.trajectory is not None:
+            self.trajectory.extract(model, done, self.parameters)
+
         # adjust the final reward if the time limit has not been reached
         if done:
             m = model.as_pyscipopt()
@@ -117,6 +212,7 @@ class TimeLimitPrimalDualIntegral(ecole.reward.PrimalDualIntegral):
 
     def __init__(self):
         self.parameters = IntegralParameters()
+        self.trajectory = None
         super().__init__(wall=True, bound_function=lambda model: (
             self.parameters.initial_primal_bound,
             self.parameters.initial_dual_bound))
@@ -127,13 +223,22 @@ class TimeLimitPrimalDualIntegral(ecole.reward.PrimalDualIntegral):
             initial_primal_bound=initial_primal_bound,
             initial_dual_bound=initial_dual_bound)
 
+    def set_trajectory_file(self, trajectory_file=None):
+        """Record the bound trajectory of the next episodes to the given file (None to disable)."""
+        self.trajectory = BoundTrajectory(trajectory_file) if trajectory_file is not None else None
+
     def before_reset(self, model):
         self.parameters.fetch_values(model)
+        if self.trajectory is not None:
+            self.trajectory.before_reset(model)
         super().before_reset(model)
 
     def extract(self, model, done):
         reward = super().extract(model, done)
 
+        if self.trajectory is not None:
+            self.trajectory.extract(model, done, self.parameters)
+
         # adjust the final reward if the time limit has not been reached
         if done:
             m = model.as_pyscipopt()
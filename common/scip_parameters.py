@@ -0,0 +1,247 @@
+import collections
+import json
+import os
+import pathlib
+import re
+
+
+# full list of SCIP parameters, as written by SCIP in a settings file
+DEFAULT_PARAMETER_FILE = pathlib.Path(__file__).with_name('scip_parameters.txt')
+
+# SMAC cannot handle too large limits, so ranges are clipped to these
+REAL_LIMIT = 1e+100
+INTEGER_LIMIT = 2**31 - 1
+
+# e.g. "# [type: int, advanced: FALSE, range: [-1,65534], default: 10]", strings have no range
+HEADER_REGEX = re.compile(r'# \[type: (\w+), advanced: (TRUE|FALSE)(?:, range: ([{\[][^}\]]*[}\]]))?, default: (.*)\]$')
+SETTING_REGEX = re.compile(r'([^\s=]+)\s*=\s*(.*)$')
+
+# e.g. "separating/maxcuts integer [0,2147483647] [100]"
+PCS_REGEX = re.compile(r'(\S+)\s+(categorical|integer|real)\s+([{\[][^}\]]*[}\]])\s+\[([^\]]*)\]$')
+
+
+def parse_value(param_type, text):
+    """Typed value of a parameter, from its text in a settings file."""
+    if param_type == 'bool':
+        return {'TRUE': True, 'FALSE': False}[text]
+    elif param_type in ('int', 'longint'):
+        return int(text)
+    elif param_type == 'real':
+        return float(text)
+    elif param_type == 'string':
+        return text[1:-1] if text.startswith('"') else text
+    else:  # char
+        return text
+
+
+def format_value(value):
+    """Text of a parameter value in a settings or pcs file."""
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e+15:
+        return str(int(value))
+    return str(value)
+
+
+class Parameter(collections.namedtuple('Parameter', ['name', 'type', 'advanced', 'range', 'default', 'description'])):
+    """
+    A SCIP parameter. Its range is the tuple of possible values of bool and char parameters,
+    the (lower, upper) bounds of numerical parameters, and None for strings. Values are typed:
+    bool, int (int and longint parameters), float or str.
+    """
+    __slots__ = ()
+
+    @property
+    def tunable(self):
+        """Whether the parameter can be tuned by SMAC: neither a string nor a numerical parameter with an infinite default."""
+        if self.type == 'string':
+            return False
+        if self.type == 'real':
+            return abs(self.default) <= REAL_LIMIT
+        if self.type in ('int', 'longint'):
+            return abs(self.default) <= INTEGER_LIMIT
+        return True
+
+    def pcs_entry(self):
+        """(kind, range, default) of the parameter in a pcs file, with ranges clipped to what SMAC handles."""
+        if self.type in ('bool', 'char'):
+            return 'categorical', tuple(format_value(value) for value in self.range), format_value(self.default)
+        limit = REAL_LIMIT if self.type == 'real' else INTEGER_LIMIT
+        lower, upper = max(self.range[0], -limit), min(self.range[1], limit)
+        return 'real' if self.type == 'real' else 'integer', (lower, upper), self.default
+
+
+def make_parameter(name, param_type, advanced, param_range, default, description=''):
+    """Parameter from the fields of its header in a settings file."""
+    if param_range is None:
+        values = None
+    elif param_type == 'bool':
+        values = (True, False)
+    elif param_type == 'char':
+        values = tuple(param_range[1:-1])
+    else:
+        lower, upper = param_range[1:-1].split(',')
+        values = (parse_value(param_type, lower), parse_value(param_type, upper))
+    return Parameter(name, param_type, advanced == 'TRUE', values, parse_value(param_type, default), description)
+
+
+def parse_parameter_file(parameter_file):
+    """
+    Parses a SCIP settings file with parameter descriptions, such as the one written by
+    SCIP's "set save" or scip_parameters.txt: blocks of comment lines (description, then
+    "[type: ..., range: ..., default: ...]"), each followed by a "name = value" line.
+
+    Returns
+    -------
+    parameters : list
+        Parameter of each block, in file order.
+    """
+    parameters = []
+    description, header = [], None
+    with open(parameter_file) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                description, header = [], None
+            elif line.startswith('#'):
+                match = HEADER_REGEX.match(line)
+                if match is not None:
+                    header = match
+                else:
+                    description.append(line[1:].strip())
+            else:
+                match = SETTING_REGEX.match(line)
+                if match is None or header is None:
+                    raise ValueError(f"{parameter_file}:{line_number}: expected a parameter setting after its type description, got '{line}'")
+                parameters.append(make_parameter(match.group(1), *header.groups(), description=' '.join(description)))
+                description, header = [], None
+    return parameters
+
+
+class ParameterCatalogue():
+    """
+    Index of SCIP parameters by name. The catalogue is parsed from a settings file once, then
+    serialized next to it (JSON) and loaded from there until the settings file changes.
+
+    Parameters
+    ----------
+    parameters : iterable
+        Parameters of the catalogue.
+    """
+
+    def __init__(self, parameters):
+        self.parameters = {parameter.name: parameter for parameter in parameters}
+
+    @classmethod
+    def load(cls, parameter_file=DEFAULT_PARAMETER_FILE):
+        parameter_file = pathlib.Path(parameter_file)
+        cache_file = parameter_file.with_suffix('.json')
+        stat = os.stat(parameter_file)
+        source = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+        try:
+            with open(cache_file) as f:
+                catalogue = json.load(f)
+            if catalogue['source'] == source:
+                return cls(Parameter(name, param_type, advanced, tuple(values) if values is not None else None, default, description)
+                           for name, param_type, advanced, values, default, description in catalogue['parameters'])
+        except (OSError, ValueError, KeyError):
+            pass  # missing, outdated or corrupted
+
+        parameters = parse_parameter_file(parameter_file)
+        try:
+            tmp_file = cache_file.with_name(f"tmp_{cache_file.name}_{os.getpid()}")
+            with open(tmp_file, 'w') as f:
+                json.dump({'source': source, 'parameters': parameters}, f)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass  # read-only installation, parse again next time
+        return cls(parameters)
+
+    def __getitem__(self, name):
+        return self.parameters[name]
+
+    def __contains__(self, name):
+        return name in self.parameters
+
+    def __iter__(self):
+        return iter(self.parameters.values())
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def select(self, parameter_file):
+        """
+        Parameters of a settings file in the same format (e.g. parameters_to_tune.txt),
+        checked against the catalogue. Their ranges and defaults are the ones of the file,
+        so that a tuning range can be narrowed there.
+        """
+        parameters = parse_parameter_file(parameter_file)
+        for parameter in parameters:
+            if parameter.name not in self:
+                raise ValueError(f"Unknown SCIP parameter '{parameter.name}' in {parameter_file}.")
+            if parameter.type != self[parameter.name].type:
+                raise ValueError(f"SCIP parameter '{parameter.name}' has type {self[parameter.name].type}, not {parameter.type}, in {parameter_file}.")
+        return parameters
+
+
+def make_hyperparameter(name, kind, values, default):
+    """ConfigSpace hyperparameter of a pcs entry."""
+    import ConfigSpace.hyperparameters as CSH
+
+    if kind == 'categorical':
+        return CSH.CategoricalHyperparameter(name, choices=list(values), default_value=default)
+    elif kind == 'integer':
+        return CSH.UniformIntegerHyperparameter(name, lower=int(values[0]), upper=int(values[1]), default_value=int(default))
+    else:
+        return CSH.UniformFloatHyperparameter(name, lower=float(values[0]), upper=float(values[1]), default_value=float(default))
+
+
+def configuration_space(parameters):
+    """ConfigSpace configuration space of the given parameters, which must be tunable."""
+    from ConfigSpace import ConfigurationSpace
+
+    cs = ConfigurationSpace()
+    cs.add_hyperparameters([make_hyperparameter(parameter.name, *parameter.pcs_entry()) for parameter in parameters])
+    return cs
+
+
+def write_pcs(parameters, pcs_file):
+    """Writes the given parameters, which must be tunable, to a pcs file (replacing its content)."""
+    lines = []
+    for parameter in parameters:
+        kind, values, default = parameter.pcs_entry()
+        if kind == 'categorical':
+            lines.append(f"{parameter.name} {kind} {{{','.join(values)}}} [{default}]\n")
+        else:
+            lines.append(f"{parameter.name} {kind} [{format_value(values[0])},{format_value(values[1])}] [{format_value(default)}]\n")
+    with open(pcs_file, 'w') as f:
+        f.writelines(lines)
+
+
+def read_pcs(pcs_file, catalogue=None):
+    """
+    Configuration space of a pcs file, as written by write_pcs. Blank and comment lines are
+    ignored, and the last entry of a parameter wins. If a catalogue is given, the parameters
+    must belong to it.
+    """
+    entries = {}
+    with open(pcs_file) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = PCS_REGEX.match(line)
+            if match is None:
+                raise ValueError(f"{pcs_file}:{line_number}: expected 'name categorical|integer|real range [default]', got '{line}'")
+
+            name, kind, values, default = match.groups()
+            if catalogue is not None and name not in catalogue:
+                raise ValueError(f"{pcs_file}:{line_number}: unknown SCIP parameter '{name}'.")
+            entries[name] = (kind, values[1:-1].split(','), default)
+
+    from ConfigSpace import ConfigurationSpace
+
+    cs = ConfigurationSpace()
+    cs.add_hyperparameters([make_hyperparameter(name, *entry) for name, entry in entries.items()])
+    return cs
@@ -1,12 +1,27 @@
+import os
+
 import ecole as ec
 import numpy as np
 
+# optional: common/instance_features.py is only on the path when run by common/evaluate.py
+try:
+    from instance_features import InstanceFeatures
+except ImportError:
+    InstanceFeatures = None
+
+
+# instance features precomputed by common/instance_features.py, if available
+INSTANCE_FEATURES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../instances/features.npz')
+
 
 class ObservationFunction():
 
     def __init__(self, problem):
         # called once for each problem benchmark
         self.problem = problem  # to devise problem-specific observations
+        self.instance_features = None
+        if InstanceFeatures is not None and os.path.exists(INSTANCE_FEATURES_FILE):
+            self.instance_features = InstanceFeatures(INSTANCE_FEATURES_FILE)
 
     def seed(self, seed):
         # called before each episode
@@ -23,6 +38,11 @@ class ObservationFunction():
 
         m = model.as_pyscipopt()
 
+        # look up the precomputed features of the instance, if indexed
+        features = self.instance_features.lookup(m) if self.instance_features is not None else None
+        if features is not None:
+            return (features['n_vars'], features['n_conss'], features['n_intvars'], features['n_binvars'])
+
         # extract the number of variables, constraints, integer variables, and binary variables of the instance
         nvars = m.getNVars()
         nconss = m.getNConss()
@@ -1,5 +1,6 @@
 import ecole as ec
 import numpy as np
+from pyscipopt.scip import Variable
 
 
 class ObservationFunction():
@@ -7,6 +8,7 @@ class ObservationFunction():
     def __init__(self, problem):
         # called once for each problem benchmark
         self.problem = problem  # to devise problem-specific observations
+        self.run = None
 
     def seed(self, seed):
         # called before each episode
@@ -15,21 +17,27 @@ class ObservationFunction():
 
     def before_reset(self, model):
         # called when a new episode is about to start
-        pass
+        self.run = None
 
     def extract(self, model, done):
         if done:
             return None
 
         m = model.as_pyscipopt()
-        lp_columns = m.getLPColsData()
-        lp_variables = [col.getVar() for col in lp_columns]
 
-        # extract the current LP solution value and the objective coefficient of each variable in the current LP
-        lp_var_lpsols = np.asarray([var.getLPSol() for var in lp_variables])
-        lp_var_objs = np.asarray([var.getObj() for var in lp_variables])
+        # the transformed variables and their objective coefficients are only replaced when
+        # the solver restarts, so they are fetched once per run (indexed as the action set),
+        # runs being told apart by the number of nodes of the previous runs
+        run = (m.getNTotalNodes() - m.getNNodes(), m.getNVars())
+        if run != self.run:
+            self.run = run
+            self.variables = m.getVars(transformed=True)
+            self.objs = np.fromiter(map(Variable.getObj, self.variables), dtype=np.float64, count=len(self.variables))
+
+        # extract the current LP solution value of each variable, straight into a numpy array
+        lpsols = np.fromiter(map(Variable.getLPSol, self.variables), dtype=np.float64, count=len(self.variables))
 
-        observation = (lp_var_lpsols, lp_var_objs)
+        observation = (lpsols, self.objs)
 
         return observation
 
@@ -51,8 +59,11 @@ class Policy():
         lp_var_lpsols, lp_var_objs = observation
 
         # choose branching variable among the candidates
-        candidate_objs = lp_var_objs[branching_candidates]
-        candidate_probs = np.exp(np.abs(candidate_objs)) / np.sum(np.exp(np.abs(candidate_objs)))
+        # softmax over the absolute objective coefficients, in log-sum-exp form so that it does not overflow
+        candidate_logits = np.abs(lp_var_objs[branching_candidates])
+        max_logit = candidate_logits.max()
+        candidate_log_probs = candidate_logits - (max_logit + np.log(np.sum(np.exp(candidate_logits - max_logit))))
+        candidate_probs = np.exp(candidate_log_probs)
         branching_var = self.rng.choice(branching_candidates, p=candidate_probs)  # weighted random sampling
 
         action = branching_var
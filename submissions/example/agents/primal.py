@@ -1,5 +1,6 @@
 import ecole as ec
 import numpy as np
+from pyscipopt.scip import Variable
 
 
 class ObservationFunction():
@@ -7,6 +8,7 @@ class ObservationFunction():
     def __init__(self, problem):
         # called once for each problem benchmark
         self.problem = problem  # to devise problem-specific observations
+        self.run = None
 
     def seed(self, seed):
         # called before each episode
@@ -15,23 +17,34 @@ class ObservationFunction():
 
     def before_reset(self, model):
         # called when a new episode is about to start
-        pass
+        self.run = None
 
     def extract(self, model, done):
         if done:
             return None
 
         m = model.as_pyscipopt()
-        variables = m.getVars(transformed=True)
+
+        # the transformed variables only exist once presolving is done, and are only replaced
+        # when the solver restarts, so they are fetched once per run, along with the buffers
+        # of the observation (runs are told apart by the number of nodes of the previous runs)
+        run = (m.getNTotalNodes() - m.getNNodes(), m.getNVars())
+        if run != self.run:
+            self.run = run
+            self.variables = m.getVars(transformed=True)
+            n_vars = len(self.variables)
+            self.lbs, self.ubs = np.empty(n_vars), np.empty(n_vars)
+            self.has_lb, self.has_ub = np.empty(n_vars, dtype=bool), np.empty(n_vars, dtype=bool)
         inf = m.infinity()
 
-        # extract the upper and lower bounds of all variables
-        lbs = np.asarray([v.getLbLocal() for v in variables])
-        ubs = np.asarray([v.getUbLocal() for v in variables])
-        has_lb = np.asarray([lb > -inf for lb in lbs])
-        has_ub = np.asarray([ub < inf for ub in ubs])
+        # extract the upper and lower bounds of all variables into the buffers (neither PySCIPOpt
+        # nor Ecole can read them in bulk once solving has started, so this is one call per variable)
+        self.lbs[:] = list(map(Variable.getLbLocal, self.variables))
+        self.ubs[:] = list(map(Variable.getUbLocal, self.variables))
+        np.greater(self.lbs, -inf, out=self.has_lb)
+        np.less(self.ubs, inf, out=self.has_ub)
 
-        observation = (has_lb, has_ub, lbs, ubs)
+        observation = (self.has_lb, self.has_ub, self.lbs, self.ubs)
 
         return observation
 